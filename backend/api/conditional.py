@@ -0,0 +1,77 @@
+from hashlib import sha1
+
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+
+from .versions import bump_version, get_version, version_time
+from .viewer_state import VERSION_KEY as VIEWER_VERSION
+
+TAGS_VERSION = 'tags'
+
+
+class Validators:
+    """ETag и Last-Modified, собранные из версий данных ответа."""
+
+    def __init__(self):
+        self.parts = []
+        self.last_modified = 0
+
+    def add(self, value, modified=None):
+        self.parts.append(str(value))
+        if modified is not None:
+            self.last_modified = max(self.last_modified, int(modified))
+        return self
+
+    def add_version(self, key):
+        version = get_version(key)
+        return self.add(version, version_time(version))
+
+    def add_viewer(self, user):
+        if user.is_anonymous:
+            return self.add('anonymous')
+        return self.add_version(VIEWER_VERSION.format(user.id))
+
+    @property
+    def etag(self):
+        digest = sha1('|'.join(self.parts).encode()).hexdigest()
+        return f'"{digest}"'
+
+
+def catalog(*keys):
+    validators = Validators()
+    for key in keys:
+        validators.add_version(key)
+    return validators
+
+
+def conditional_response(request, validators, respond, personalized=False):
+    """Отвечает 304 до сериализации, если версия у клиента актуальна.
+
+    Персональные ответы помечаются private и зависят от авторизации,
+    поэтому общие кэши не отдадут их другим пользователям.
+    """
+    validators.add(getattr(request, 'accepted_media_type', ''))
+    etag = validators.etag
+    last_modified = validators.last_modified or None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = respond()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Accept',))
+    if personalized:
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def invalidate_tags():
+    bump_version(TAGS_VERSION)
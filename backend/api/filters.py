@@ -1,23 +1,53 @@
+import threading
+
 import django_filters
+from django.db.models import Exists, OuterRef
 
-from recipes.models import Ingredient, Recipe
+from recipes.models import Recipe, Tag, TagRecipe
 
+from .conditional import TAGS_VERSION
+from .versions import get_version
 
-class IngredientFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(
-        field_name='name',
-        lookup_expr='icontains'
-    )
 
-    class Meta:
-        model = Ingredient
-        fields = ('name', )
+class TagSlugs:
+    """Слаги тегов в памяти процесса, перечитываются при смене версии."""
+
+    def __init__(self):
+        self._ids = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_ids(self):
+        version = get_version(TAGS_VERSION)
+        if self._ids is None or self._version != version:
+            with self._lock:
+                if self._ids is None or self._version != version:
+                    self._ids = dict(Tag.objects.values_list('slug', 'id'))
+                    self._version = version
+        return self._ids
+
+
+tag_slugs = TagSlugs()
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_slugs.get_ids()]
 
 
 class RecipeFilter(django_filters.FilterSet):
-    tags = django_filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = django_filters.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags'
+    )
     name = django_filters.CharFilter(field_name='author')
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags')
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов: EXISTS вместо JOIN не
+        размножает строки и не требует DISTINCT."""
+        ids = tag_slugs.get_ids()
+        return queryset.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=[ids[slug] for slug in value]
+        )))
@@ -0,0 +1,158 @@
+import binascii
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from recipes.models import Recipe
+
+UPLOAD_DIR = 'recipes/uploads/'
+UPLOAD_SALT = 'recipe-image-upload'
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+# Длина куска base64, кратная 4: декодируется без остатка.
+CHUNK_SIZE = 64 * 1024
+
+
+def check_image(file):
+    """Проверяет размер, формат и число пикселей, не декодируя картинку.
+
+    Возвращает расширение файла по формату картинки.
+    """
+    # Pillow нужен только при загрузке картинок, не при старте воркера.
+    from PIL import Image
+
+    if file.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise serializers.ValidationError(
+            'Картинка больше {} байт'.format(settings.IMAGE_UPLOAD_MAX_SIZE)
+        )
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            image_format = image.format
+            width, height = image.size
+            if image_format in EXTENSIONS:
+                image.verify()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise serializers.ValidationError('Загрузите корректную картинку')
+    finally:
+        file.seek(0)
+    if image_format not in EXTENSIONS:
+        raise serializers.ValidationError(
+            'Допустимые форматы: {}'.format(', '.join(EXTENSIONS))
+        )
+    if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise serializers.ValidationError(
+            'Картинка больше {} пикселей'.format(
+                settings.IMAGE_UPLOAD_MAX_PIXELS
+            )
+        )
+    return EXTENSIONS[image_format]
+
+
+def decode_base64(data):
+    """Декодирует base64 кусками во временный файл на диске."""
+    start = data.find(';base64,', 0, 100)
+    start = 0 if start == -1 else start + len(';base64,')
+    if (len(data) - start) * 3 // 4 > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise serializers.ValidationError(
+            'Картинка больше {} байт'.format(settings.IMAGE_UPLOAD_MAX_SIZE)
+        )
+    file = TemporaryUploadedFile('image', 'application/octet-stream', 0, None)
+    rest = ''
+    try:
+        for position in range(start, len(data), CHUNK_SIZE):
+            chunk = rest + ''.join(
+                data[position:position + CHUNK_SIZE].split()
+            )
+            size = len(chunk) - len(chunk) % 4
+            file.write(binascii.a2b_base64(chunk[:size]))
+            rest = chunk[size:]
+        if rest:
+            raise binascii.Error('Incorrect padding')
+    except (binascii.Error, ValueError):
+        file.close()
+        raise serializers.ValidationError('Загрузите корректную картинку')
+    file.size = file.tell()
+    return file
+
+
+def save_upload(file, user):
+    """Сохраняет загруженную картинку и возвращает её id для рецепта."""
+    extension = check_image(file)
+    name = default_storage.save(
+        f'{UPLOAD_DIR}{uuid.uuid4().hex}.{extension}', file
+    )
+    return signing.dumps({'name': name, 'user': user.id}, salt=UPLOAD_SALT)
+
+
+def open_upload(upload_id, user):
+    try:
+        upload = signing.loads(
+            upload_id, salt=UPLOAD_SALT,
+            max_age=settings.IMAGE_UPLOAD_MAX_AGE
+        )
+    except signing.BadSignature:
+        raise serializers.ValidationError('Загрузка не найдена или устарела')
+    if upload['user'] != user.id or not default_storage.exists(
+        upload['name']
+    ):
+        raise serializers.ValidationError('Загрузка не найдена или устарела')
+    file = default_storage.open(upload['name'])
+    file.upload_name = upload['name']
+    return file
+
+
+def release_upload(file):
+    """Закрывает файл, когда рецепт сохранил свою копию, и удаляет
+    исходную загрузку."""
+    file.close()
+    name = getattr(file, 'upload_name', None)
+    if name:
+        transaction.on_commit(lambda: default_storage.delete(name))
+
+
+class ImageUploadField(serializers.ImageField):
+    """Картинка рецепта: строка base64 или id файла, загруженного через
+    recipes/images/.
+
+    Картинка не читается в память целиком: base64 декодируется во
+    временный файл, а Pillow читает только заголовок и проверяет
+    структуру файла потоково.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or not data:
+            raise serializers.ValidationError(
+                'Передайте картинку в base64 или id загрузки'
+            )
+        if ':' in data and ';base64,' not in data[:100]:
+            file = open_upload(data, self.context['request'].user)
+        else:
+            file = decode_base64(data)
+        extension = check_image(file)
+        file.name = f'{uuid.uuid4().hex}.{extension}'
+        return file
+
+
+def expired_uploads():
+    """Загрузки старше IMAGE_UPLOAD_MAX_AGE, на которые не сослался
+    ни один рецепт."""
+    if not default_storage.exists(UPLOAD_DIR):
+        return
+    limit = timezone.now() - timedelta(seconds=settings.IMAGE_UPLOAD_MAX_AGE)
+    _, names = default_storage.listdir(UPLOAD_DIR)
+    names = {UPLOAD_DIR + name for name in names}
+    # Рецепты, импортированные до копирования загрузок, ссылаются
+    # на них напрямую.
+    names -= set(Recipe.objects.filter(image__in=names).values_list(
+        'image', flat=True
+    ))
+    for name in names:
+        if default_storage.get_modified_time(name) < limit:
+            yield name
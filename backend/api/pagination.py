@@ -1,5 +1,32 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    ordering = ('-pub_date', 'id')
+    page_size_query_param = 'limit'
+
+
+class RecipePagination(CustomPageNumberPagination):
+    """Навигация по номеру страницы, а при переданном параметре cursor —
+    по курсору: без COUNT(*) и OFFSET, страницы не сдвигаются при
+    добавлении новых рецептов. Первая страница — ?cursor=."""
+
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = RecipeCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
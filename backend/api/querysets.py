@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+from django.db.models import Exists, F, OuterRef, Prefetch, Window
+from django.db.models.functions import RowNumber
+
+from recipes.models import (Favorite, Follow, IngredientRecipe, Recipe,
+                            ShoppingCart)
+
+from .viewer_state import get_viewer_state
+
+READ_ACTIONS = ('list', 'retrieve')
+
+
+def ingredients_prefetch():
+    return Prefetch(
+        'ingredient_recipe',
+        queryset=IngredientRecipe.objects.select_related('ingredient')
+    )
+
+
+def is_favorited(user):
+    return Exists(Favorite.objects.filter(user=user, recipe=OuterRef('pk')))
+
+
+def is_in_shopping_cart(user):
+    return Exists(ShoppingCart.objects.filter(
+        user=user, recipe=OuterRef('pk')
+    ))
+
+
+def with_viewer_flags(queryset, user):
+    return queryset.annotate(
+        is_favorited=is_favorited(user),
+        is_in_shopping_cart=is_in_shopping_cart(user),
+    )
+
+
+def is_subscribed(user):
+    return Exists(Follow.objects.filter(user=user, author=OuterRef('pk')))
+
+
+def with_subscription(queryset, request):
+    """Отметка подписки для пользователей без кэшированного состояния."""
+    user = request.user
+    if user.is_anonymous or get_viewer_state(request) is not None:
+        return queryset
+    return queryset.annotate(is_subscribed=is_subscribed(user))
+
+
+def recipe_queryset(queryset, action, request):
+    """Рецепты для чтения: теги и ингредиенты берутся из снимков,
+    RecipeListSerializer догружает их только для рецептов без снимка."""
+    if action not in READ_ACTIONS:
+        return queryset
+    queryset = queryset.select_related('author')
+    user = request.user
+    if not user.is_anonymous and get_viewer_state(request) is None:
+        queryset = with_viewer_flags(queryset, user).annotate(
+            author_is_subscribed=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author_id')
+            ))
+        )
+    return queryset
+
+
+def get_recipes_limit(request):
+    value = request.query_params.get('recipes_limit') if request else None
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
+
+
+def recipe_previews(author_ids, limit=None):
+    """Последние limit рецептов каждого автора одним запросом.
+
+    Номер рецепта внутри автора считается оконной функцией ROW_NUMBER,
+    отбор по нему делается во внешнем запросе.
+    """
+    previews = defaultdict(list)
+    # Пустой IN не компилируется в SQL: sql_with_params бросит
+    # EmptyResultSet.
+    if not author_ids:
+        return previews
+    ranked = Recipe.objects.filter(author_id__in=author_ids).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=[F('pub_date').desc(), F('id').desc()],
+        )
+    ).order_by()
+    sql, params = ranked.query.sql_with_params()
+    condition = 'WHERE ranked.position <= %s' if limit is not None else ''
+    if limit is not None:
+        params = (*params, limit)
+    for recipe in Recipe.objects.raw(
+        f'SELECT * FROM ({sql}) ranked {condition} '
+        'ORDER BY ranked.position',
+        params
+    ):
+        previews[recipe.author_id].append(recipe)
+    return previews
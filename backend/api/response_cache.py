@@ -0,0 +1,58 @@
+from functools import partial
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from .versions import bump_version, get_version
+
+RECIPES_VERSION = 'recipes'
+
+
+def normalized_params(query_params):
+    """Параметры запроса в каноническом виде: ключи и значения
+    отсортированы, пустые значения и повторы отброшены.
+
+    Ключ без значений остаётся: пустой cursor включает другую навигацию.
+    """
+    params = []
+    for key in sorted(query_params):
+        values = sorted({value for value in query_params.getlist(key)
+                         if value})
+        params.extend(f'{key}={value}' for value in values or [''])
+    return '&'.join(params)
+
+
+def cache_key(request, versions):
+    parts = [
+        *versions, request.build_absolute_uri(request.path),
+        normalized_params(request.query_params),
+    ]
+    return 'response:' + sha1('|'.join(parts).encode()).hexdigest()
+
+
+def cached_response(request, version_keys, respond, anonymous_only=False):
+    """Данные ответа из кэша, если не менялась ни одна из версий.
+
+    Записи не удаляются: при изменении данных меняется версия, и старые
+    ключи просто перестают запрашиваться.
+    """
+    if anonymous_only and not request.user.is_anonymous:
+        return respond()
+    key = cache_key(request, [get_version(key) for key in version_keys])
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+    response = respond()
+    if response.status_code == 200:
+        cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+    return response
+
+
+def invalidate_recipes():
+    # Повторно после коммита: связанные строки рецепта пишутся после
+    # сохранения самого рецепта.
+    bump_version(RECIPES_VERSION)
+    transaction.on_commit(partial(bump_version, RECIPES_VERSION))
@@ -0,0 +1,106 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from recipes.models import Ingredient
+
+from .serializers import IngredientSerializer
+from .versions import bump_version, get_version
+
+VERSION_KEY = 'ingredient-index'
+
+
+def normalize(text):
+    """Приводит строку к виду для сравнения без учёта регистра и ё."""
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class IngredientIndex:
+    """Индекс ингредиентов для автодополнения.
+
+    Названия хранятся отсортированными: совпадения по началу названия
+    ищутся бинарным поиском, вхождения в середину — по триграммам.
+    """
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: normalize(item['name']))
+        self.names = [normalize(item['name']) for item in self.items]
+        self.grams = defaultdict(set)
+        for position, name in enumerate(self.names):
+            for gram in trigrams(name):
+                self.grams[gram].add(position)
+
+    def prefix_matches(self, query):
+        position = bisect_left(self.names, query)
+        while (position < len(self.names)
+               and self.names[position].startswith(query)):
+            yield position
+            position += 1
+
+    def substring_matches(self, query):
+        grams = trigrams(query)
+        if grams:
+            # get, а не [], чтобы триграммы запросов не копились в индексе.
+            postings = [self.grams.get(gram) for gram in grams]
+            if not all(postings):
+                return []
+            candidates = set.intersection(*sorted(postings, key=len))
+        else:
+            candidates = range(len(self.names))
+        found = (
+            (self.names[position].find(query), position)
+            for position in candidates
+        )
+        return [position for index, position in sorted(found) if index > 0]
+
+    def search(self, query, limit):
+        query = normalize(query)
+        if not query:
+            return []
+        result = []
+        for position in self.prefix_matches(query):
+            if len(result) == limit:
+                return result
+            result.append(self.items[position])
+        for position in self.substring_matches(query):
+            if len(result) == limit:
+                break
+            result.append(self.items[position])
+        return result
+
+
+class IngredientSearch:
+    """Индекс в памяти процесса, перестраивается при смене версии."""
+
+    def __init__(self):
+        self._index = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_index(self):
+        version = get_version(VERSION_KEY)
+        if self._index is None or self._version != version:
+            with self._lock:
+                if self._index is None or self._version != version:
+                    self._index = self.build()
+                    self._version = version
+        return self._index
+
+    def build(self):
+        return IngredientIndex(IngredientSerializer(
+            Ingredient.objects.all(), many=True
+        ).data)
+
+    def search(self, query, limit):
+        return self.get_index().search(query, limit)
+
+
+ingredient_search = IngredientSearch()
+
+
+def invalidate_ingredient_index():
+    bump_version(VERSION_KEY)
@@ -1,20 +1,32 @@
-from drf_extra_fields.fields import Base64ImageField
+from collections import Counter, OrderedDict
+
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers, validators
 
+from foodgram.profiling import TimedSerializerMixin
+from recipes import shopping_list, thumbnails
 from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
-                            Recipe, ShoppingCart, Tag, TagRecipe)
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe)
 from users.models import User
 from users.serializers import UserSerializer
 
+from .images import ImageUploadField, release_upload
+from .querysets import get_recipes_limit, ingredients_prefetch
+from .snapshots import get_snapshots
+from .viewer_state import get_viewer_state
+
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     measurement_unit = serializers.CharField(source='unit')
 
     class Meta:
@@ -39,74 +51,140 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
-    author = UserSerializer(read_only=True)
+class AuthorSnapshotSerializer(UserSerializer):
+
+    def get_is_subscribed(self, obj):
+        return False
+
+
+class RecipeSnapshotSerializer(serializers.ModelSerializer):
+    """Поля рецепта, одинаковые для всех пользователей.
+
+    Ссылки на картинки относительные, флаги пользователя заполняет
+    RecipeListSerializer.
+    """
+    author = AuthorSnapshotSerializer(read_only=True)
     tags = TagSerializer(read_only=True, many=True)
-    ingredients = serializers.SerializerMethodField()
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    ingredients = IngredientRecipeSerializer(
+        source='ingredient_recipe', read_only=True, many=True
+    )
+    is_favorited = serializers.SerializerMethodField('get_viewer_flag')
+    is_in_shopping_cart = serializers.SerializerMethodField('get_viewer_flag')
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'thumbnails', 'text',
+            'cooking_time'
         )
 
-    def get_is_favorited(self, obj):
-        request = self.context.get('request', None)
-        user = request.user
-        is_favorited = False
-        recipe = obj
-        try:
-            is_favorited = Favorite.objects.filter(
-                user=user, recipe=recipe
-            ).exists()
-        except Exception:
-            return is_favorited
-        return is_favorited
-
-    def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request', None)
-        user = request.user
-        is_in_cart = False
-        recipe = obj
-        try:
-            is_in_cart = ShoppingCart.objects.filter(
-                user=user, recipe=recipe
-            ).exists()
-        except Exception:
-            return is_in_cart
-        return is_in_cart
-
-    def get_ingredients(self, obj):
-        return IngredientRecipeSerializer(
-            IngredientRecipe.objects.filter(recipe=obj).all(), many=True
-        ).data
+    def get_viewer_flag(self, obj):
+        return False
+
+    def get_thumbnails(self, obj):
+        return {
+            size: {
+                image_format: default_storage.url(name)
+                for image_format, name in formats.items()
+            }
+            for size, formats in obj.thumbnails.items()
+        }
+
+
+def build_snapshots(recipes):
+    """Снимки рецептов: два запроса на теги и ингредиенты всех рецептов,
+    авторы уже выбраны вместе с рецептами."""
+    prefetch_related_objects(recipes, 'tags', ingredients_prefetch())
+    return RecipeSnapshotSerializer(recipes, many=True).data
+
+
+class RecipePageSerializer(TimedSerializerMixin, serializers.ListSerializer):
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        return self.child.represent(list(data))
+
+
+class RecipeListSerializer(TimedSerializerMixin, RecipeSnapshotSerializer):
+    """Снимок рецепта из кэша и флаги текущего пользователя."""
+
+    class Meta(RecipeSnapshotSerializer.Meta):
+        list_serializer_class = RecipePageSerializer
+
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
+
+    def represent(self, recipes):
+        request = self.context.get('request')
+        state = get_viewer_state(request)
+        representations = []
+        for recipe, snapshot in zip(
+            recipes, get_snapshots(recipes, build_snapshots)
+        ):
+            data = OrderedDict(snapshot)
+            if state is not None:
+                data['is_favorited'] = recipe.id in state.favorites
+                data['is_in_shopping_cart'] = recipe.id in state.shopping_cart
+                subscribed = recipe.author_id in state.following
+            else:
+                data['is_favorited'] = getattr(recipe, 'is_favorited', False)
+                data['is_in_shopping_cart'] = getattr(
+                    recipe, 'is_in_shopping_cart', False
+                )
+                subscribed = getattr(recipe, 'author_is_subscribed', False)
+            data['author'] = OrderedDict(
+                snapshot['author'], is_subscribed=subscribed
+            )
+            if request is not None:
+                if data['image']:
+                    data['image'] = request.build_absolute_uri(data['image'])
+                data['thumbnails'] = {
+                    size: {
+                        image_format: request.build_absolute_uri(url)
+                        for image_format, url in formats.items()
+                    }
+                    for size, formats in snapshot['thumbnails'].items()
+                }
+            representations.append(data)
+        return representations
 
 
 class IngredientRecipeCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    # Существование ингредиентов проверяется одним запросом
+    # в RecipeSerializer.validate_ingredients.
+    id = serializers.IntegerField(source='ingredient_id')
 
     class Meta:
         model = IngredientRecipe
         fields = ('id', 'amount')
 
 
+class TagIdsField(serializers.ListField):
+    child = serializers.IntegerField()
+
+    def to_representation(self, tags):
+        return [tag.id for tag in tags.all()]
+
+
+def missing_ids(model, ids):
+    """Id из списка, которых нет в базе, одним запросом."""
+    found = set(model.objects.filter(id__in=ids).values_list(
+        'id', flat=True
+    ))
+    return set(ids) - found
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    tags = serializers.SlugRelatedField(
-        many=True,
-        queryset=Tag.objects.all(),
-        slug_field='id'
-    )
+    tags = TagIdsField()
     ingredients = IngredientRecipeCreateSerializer(
         many=True,
         source='ingredient_recipe'
     )
-    image = Base64ImageField()
+    image = ImageUploadField()
 
     class Meta:
         model = Recipe
@@ -116,49 +194,141 @@ class RecipeSerializer(serializers.ModelSerializer):
             'text', 'cooking_time',
         )
 
+    @staticmethod
+    def set_ingredients(recipe, ingredients, created=False):
+        """Приводит ингредиенты рецепта к переданным: одна вставка,
+        одно обновление и одно удаление на весь список.
+
+        Возвращает старые и новые количества оставшихся строк для списков
+        покупок: удалённые строки списки учли по сигналу post_delete.
+        """
+        new_amounts = Counter()
+        for item in ingredients:
+            new_amounts[item['ingredient_id']] += item['amount']
+        rows = {}
+        to_delete = []
+        for row in [] if created else recipe.ingredient_recipe.all():
+            if row.ingredient_id in new_amounts and (
+                row.ingredient_id not in rows
+            ):
+                rows[row.ingredient_id] = row
+            else:
+                to_delete.append(row.pk)
+        old_amounts = Counter({
+            ingredient_id: row.amount for ingredient_id, row in rows.items()
+        })
+        to_update = []
+        for ingredient_id, row in rows.items():
+            if row.amount != new_amounts[ingredient_id]:
+                row.amount = new_amounts[ingredient_id]
+                to_update.append(row)
+        to_create = [
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in rows
+        ]
+        if to_delete:
+            IngredientRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientRecipe.objects.bulk_create(to_create)
+        return old_amounts, new_amounts
+
+    @staticmethod
+    def set_tags(recipe, tags, created=False):
+        new_ids = set(tags)
+        old_ids = set() if created else set(
+            TagRecipe.objects.filter(recipe=recipe).values_list(
+                'tag_id', flat=True
+            )
+        )
+        if old_ids - new_ids:
+            TagRecipe.objects.filter(
+                recipe=recipe, tag_id__in=old_ids - new_ids
+            ).delete()
+        if new_ids - old_ids:
+            TagRecipe.objects.bulk_create(
+                TagRecipe(recipe=recipe, tag_id=tag_id)
+                for tag_id in new_ids - old_ids
+            )
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredient_recipe')
         tags = validated_data.pop('tags')
         image = validated_data.pop('image')
         recipe = Recipe.objects.create(**validated_data, image=image)
-        bulk_list = list()
-        for elem in ingredients:
-            bulk_list.append(
-                IngredientRecipe(
-                    ingredient=elem['id'],
-                    recipe=recipe,
-                    amount=elem['amount']
-                )
-            )
-        IngredientRecipe.objects.bulk_create(bulk_list)
-        for tag in tags:
-            TagRecipe.objects.create(
-                tag=tag, recipe=recipe)
+        release_upload(image)
+        thumbnails.schedule(recipe.id)
+        self.set_ingredients(recipe, ingredients, created=True)
+        self.set_tags(recipe, tags, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients_data = validated_data.pop('ingredient_recipe')
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredient_recipe', None)
+        if ingredients is not None:
+            shopping_list.lock_recipe(instance.id)
+        if 'image' in validated_data:
+            instance.thumbnails = {}
         super().update(instance, validated_data)
-        instance.tags.set(tags)
-        instance.save()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        for ingredient in ingredients_data:
-            curr_ingredient = ingredient['id']
-            amount = ingredient['amount']
-            IngredientRecipe.objects.update_or_create(
-                ingredient=curr_ingredient, recipe=instance, amount=amount)
+        if 'image' in validated_data:
+            release_upload(validated_data['image'])
+            thumbnails.schedule(instance.id)
+        if tags is not None:
+            self.set_tags(instance, tags)
+        if ingredients is not None:
+            shopping_list.change_recipe(
+                instance.id, *self.set_ingredients(instance, ingredients)
+            )
         return instance
 
-    def validate(self, data):
-        ingredients_data = data.get('ingredient_recipe')
-        for item in ingredients_data:
-            amount = item.get('amount')
-            if int(amount) < 1:
-                raise serializers.ValidationError(
+    def validate_tags(self, tags):
+        missing = missing_ids(Tag, tags)
+        errors = {}
+        seen = set()
+        for index, tag_id in enumerate(tags):
+            if tag_id in missing:
+                errors[index] = [
+                    f'Недопустимый первичный ключ "{tag_id}" - '
+                    'объект не существует.'
+                ]
+            elif tag_id in seen:
+                errors[index] = ['Теги не должны повторяться']
+            seen.add(tag_id)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return tags
+
+    def validate_ingredients(self, ingredients):
+        missing = missing_ids(
+            Ingredient, [item['ingredient_id'] for item in ingredients]
+        )
+        errors = []
+        seen = set()
+        for item in ingredients:
+            ingredient_id = item['ingredient_id']
+            error = {}
+            if ingredient_id in missing:
+                error['id'] = [
+                    f'Недопустимый первичный ключ "{ingredient_id}" - '
+                    'объект не существует.'
+                ]
+            elif ingredient_id in seen:
+                error['id'] = ['Ингредиенты не должны повторяться']
+            if item['amount'] < 1:
+                error['amount'] = [
                     'Количество ингредиентов должно быть больше 0'
-                )
-        return data
+                ]
+            seen.add(ingredient_id)
+            errors.append(error)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return ingredients
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -175,7 +345,9 @@ class FavoriteSerializer(serializers.ModelSerializer):
         ]
 
 
-class FavoriteShoppingSerializer(serializers.ModelSerializer):
+class FavoriteShoppingSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
 
     class Meta:
         model = Recipe
@@ -196,10 +368,23 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         ]
 
 
-class FollowListSerializer(serializers.ModelSerializer):
+class ShoppingListItemSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(source='ingredient.unit')
+    amount = serializers.ReadOnlyField(source='total')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class FollowListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -212,14 +397,18 @@ class FollowListSerializer(serializers.ModelSerializer):
         return True
 
     def get_recipes(self, obj):
+        previews = self.context.get('recipe_previews')
+        if previews is not None:
+            recipes = previews.get(obj.id, [])
+        else:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
         return FavoriteShoppingSerializer(
-            Recipe.objects.filter(author=obj).all(), many=True
+            recipes, many=True, context=self.context
         ).data
 
-    def get_recipes_count(self, obj):
-        count = obj.recipes.count()
-        return count
-
 
 class FollowSerializer(serializers.ModelSerializer):
 
@@ -0,0 +1,174 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from recipes import counters, shopping_list
+from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, Tag)
+from users.models import User
+
+from .conditional import invalidate_tags
+from .response_cache import invalidate_recipes
+from .search import invalidate_ingredient_index
+from .snapshots import touch_recipes
+from .viewer_state import invalidate_viewer_state
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    invalidate_ingredient_index()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    invalidate_tags()
+
+
+# Удаление — до каскада: после него рецепты с тегом уже не найти.
+@receiver([post_save, pre_delete], sender=Ingredient)
+def ingredient_recipes_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver([post_save, pre_delete], sender=Tag)
+def tag_recipes_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        touch_recipes(Recipe.objects.filter(tags=instance))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(sender, **kwargs):
+    invalidate_recipes()
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None,
+                 **kwargs):
+    # У нового пользователя нет рецептов, а вход и смена пароля не меняют
+    # полей автора в рецептах.
+    if created or (
+        update_fields is not None and not set(update_fields) & AUTHOR_FIELDS
+    ):
+        return
+    invalidate_recipes()
+    touch_recipes(instance.recipes.all())
+
+
+# Версия — после коммита: иначе соседний запрос успеет загрузить старые
+# связи под новой версией.
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Follow)
+def viewer_state_changed(sender, instance, **kwargs):
+    user_ids = {instance.user_id}
+    old = getattr(instance, '_saved_row', None)
+    if old is not None:
+        user_ids.add(old.user_id)
+    for user_id in user_ids:
+        transaction.on_commit(partial(invalidate_viewer_state, user_id))
+
+
+# Списки покупок ведутся по строкам, а не по представлениям API: их
+# меняют и админка, и каскады удаления рецепта, ингредиента или
+# пользователя. bulk_create и bulk_update сигналов не вызывают,
+# после них списки обновляет сам вызывающий код.
+@receiver(pre_save, sender=IngredientRecipe)
+@receiver(pre_save, sender=ShoppingCart)
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=Follow)
+def remember_row(sender, instance, **kwargs):
+    # Строку могли перенести в другой рецепт, к другому автору или
+    # пользователю.
+    if not instance._state.adding:
+        instance._saved_row = sender.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def ingredient_row_saved(sender, instance, **kwargs):
+    old = vars(instance).pop('_saved_row', None)
+    new = (instance.recipe_id, instance.ingredient_id, instance.amount)
+    if old is not None:
+        if (old.recipe_id, old.ingredient_id, old.amount) == new:
+            return
+        shopping_list.change_ingredient(
+            old.recipe_id, old.ingredient_id, -old.amount
+        )
+    shopping_list.change_ingredient(*new)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def ingredient_row_deleted(sender, instance, **kwargs):
+    shopping_list.change_ingredient(
+        instance.recipe_id, instance.ingredient_id, -instance.amount
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_row_saved(sender, instance, **kwargs):
+    old = vars(instance).pop('_saved_row', None)
+    new = (instance.user_id, instance.recipe_id)
+    if old is not None:
+        if (old.user_id, old.recipe_id) == new:
+            return
+        shopping_list.remove_recipe(old.user_id, old.recipe_id)
+    shopping_list.add_recipe(*new)
+
+
+# Каскад удаления рецепта удаляет и строки ингредиентов, и корзины.
+# Строка вычитается только из оставшихся корзин, а корзина — только
+# оставшиеся строки, поэтому рецепт вычитается из списков один раз
+# в любом порядке удаления.
+@receiver(post_delete, sender=ShoppingCart)
+def cart_row_deleted(sender, instance, **kwargs):
+    shopping_list.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+# Счётчики тоже ведутся по строкам. Каскад удаления рецепта или
+# пользователя правит и счётчики удаляемых строк: лишние UPDATE,
+# зато без особых случаев. reconcile_counters остаётся страховкой.
+COUNTED = {
+    Favorite: ('recipe_id', counters.change_favorites),
+    Follow: ('author_id', counters.change_followers),
+    Recipe: ('author_id', counters.change_recipes),
+}
+
+
+# Рецепт сохраняется при каждой правке через API: автора до правки
+# запоминает загрузка, а не лишний SELECT в pre_save.
+@receiver(post_init, sender=Recipe)
+def remember_author(sender, instance, **kwargs):
+    if 'author_id' in vars(instance):
+        instance._saved_author_id = instance.author_id
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Recipe)
+def counted_row_saved(sender, instance, created, **kwargs):
+    field, change = COUNTED[sender]
+    new = getattr(instance, field)
+    if sender is Recipe:
+        old = vars(instance).get('_saved_author_id')
+        instance._saved_author_id = new
+    else:
+        row = vars(instance).pop('_saved_row', None)
+        old = None if row is None else getattr(row, field)
+    if created:
+        change(new, 1)
+    elif old is not None and old != new:
+        change(old, -1)
+        change(new, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Recipe)
+def counted_row_deleted(sender, instance, **kwargs):
+    field, change = COUNTED[sender]
+    change(getattr(instance, field), -1)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .response_cache import invalidate_recipes
+
+SNAPSHOT_KEY = 'recipe-snapshot:{}:{}'
+
+
+def snapshot_key(recipe):
+    """Ключ снимка рецепта.
+
+    Версией снимка служит updated_at, поэтому всё, что меняет
+    представление рецепта — его ингредиенты и теги, переименование тега,
+    ингредиента или автора, — обновляет updated_at: через save() рецепта
+    или touch_recipes.
+    """
+    return SNAPSHOT_KEY.format(recipe.id, recipe.updated_at.timestamp())
+
+
+def get_snapshots(recipes, build):
+    """Снимки рецептов одним чтением из кэша.
+
+    Недостающие снимки собирает build(recipes) и они записываются
+    одной операцией.
+    """
+    keys = [snapshot_key(recipe) for recipe in recipes]
+    snapshots = cache.get_many(keys)
+    missing = [
+        (key, recipe) for key, recipe in zip(keys, recipes)
+        if key not in snapshots
+    ]
+    if missing:
+        built = dict(zip(
+            [key for key, _ in missing],
+            build([recipe for _, recipe in missing])
+        ))
+        cache.set_many(built, settings.RECIPE_SNAPSHOT_TIMEOUT)
+        snapshots.update(built)
+    return [snapshots[key] for key in keys]
+
+
+def touch_recipes(recipes):
+    """Обновляет updated_at рецептов из queryset: их снимки и ETag
+    устаревают."""
+    if recipes.update(updated_at=timezone.now()):
+        invalidate_recipes()
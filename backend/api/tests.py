@@ -1,3 +1,989 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api import images
+from api.response_cache import invalidate_recipes
+from api.search import IngredientIndex, normalize
+from api.viewer_state import ViewerStateCache
+from foodgram.fixtures import (IMAGE, TEMP_MEDIA_ROOT, TIMINGS, FixturesMixin,
+                               RecipeTestCase, quiet_request_log,
+                               write_benchmark)
+from recipes import counters, shopping_list
+from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, Tag, TagRecipe)
+from users.models import User
+
+# Сколько раз повторять каждый запрос при замере времени.
+BENCHMARK_REPEAT = int(os.getenv('BENCHMARK_REPEAT', 5))
+
+AUTHORS = 12
+RECIPES_PER_AUTHOR = 4
+INGREDIENTS_PER_RECIPE = 6
+SMALL_PAGE = 2
+LARGE_PAGE = 24
+
+
+def setUpModule():
+    quiet_request_log()
+
+
+def tearDownModule():
+    write_benchmark()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class EndpointBenchmarkTest(FixturesMixin, APITestCase):
+    """Бюджет SQL-запросов и время ответа для каждого эндпоинта API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        path = os.path.join(settings.BASE_DIR, 'recipes/data/ingredients.csv')
+        with open(path, encoding='utf-8') as f:
+            Ingredient.objects.bulk_create(
+                Ingredient(name=name, unit=unit)
+                for name, unit in csv.reader(f)
+            )
+        cls.ingredients = list(Ingredient.objects.order_by('id')[:50])
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}')
+            for i in range(3)
+        )
+        cls.tags = list(Tag.objects.order_by('id'))
+        cls.viewer = cls.create_user('viewer', first_name='Зритель')
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.authors = [
+            cls.create_user(f'author{i}', first_name='Автор', last_name=str(i))
+            for i in range(AUTHORS)
+        ]
+        Recipe.objects.bulk_create(
+            Recipe(
+                name=f'Рецепт {author.id}-{i}', text='Описание',
+                cooking_time=10 + i, image='recipes/images/test.png',
+                author=author
+            )
+            for author in cls.authors
+            for i in range(RECIPES_PER_AUTHOR)
+        )
+        recipes = list(Recipe.objects.order_by('id'))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe,
+                ingredient=cls.ingredients[(number + i) % 50],
+                amount=i + 1
+            )
+            for number, recipe in enumerate(recipes)
+            for i in range(INGREDIENTS_PER_RECIPE)
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=tag)
+            for number, recipe in enumerate(recipes)
+            for tag in cls.tags[:number % 3 + 1]
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.viewer, recipe=recipe)
+            for recipe in recipes[::2]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.viewer, recipe=recipe)
+            for recipe in recipes[::3]
+        )
+        Follow.objects.bulk_create(
+            Follow(user=cls.viewer, author=author)
+            for author in cls.authors[:3]
+        )
+        shopping_list.rebuild()
+        counters.reconcile()
+        cls.recipe = recipes[0]
+        cls.own_recipe = cls.create_recipe(cls.viewer, name='Свой рецепт')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def request(self, name, method, url, data=None, status=200, budget=None,
+                **body):
+        """Выполняет запрос, проверяет статус и бюджет запросов к БД.
+
+        По умолчанию тело кодируется в JSON, иначе передаются format или
+        content_type клиента.
+        """
+        body = body or {'format': 'json'}
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(url, data, **body)
+            if response.streaming:
+                response.streamed = b''.join(response.streaming_content)
+            TIMINGS[name].append(time.perf_counter() - start)
+        self.assertEqual(
+            response.status_code, status,
+            f'{name}: {getattr(response, "data", response)}'
+        )
+        if budget is not None:
+            self.assertLessEqual(
+                len(queries), budget,
+                f'{name}: {len(queries)} запросов, бюджет {budget}\n'
+                + '\n'.join(query['sql'] for query in queries)
+            )
+        return response, len(queries)
+
+    def benchmark(self, name, url, budget, status=200):
+        for _ in range(BENCHMARK_REPEAT):
+            self.request(name, 'get', url, status=status, budget=budget)
+
+    def assertPageSizeIndependent(self, name, url, budget):
+        separator = '&' if '?' in url else '?'
+        # Прогреваются снимки рецептов обеих страниц, но не ответы.
+        self.client.get(f'{url}{separator}limit={LARGE_PAGE}')
+        invalidate_recipes()
+        _, small = self.request(
+            f'{name} limit={SMALL_PAGE}', 'get',
+            f'{url}{separator}limit={SMALL_PAGE}', budget=budget
+        )
+        _, large = self.request(
+            f'{name} limit={LARGE_PAGE}', 'get',
+            f'{url}{separator}limit={LARGE_PAGE}', budget=budget
+        )
+        self.assertEqual(
+            small, large,
+            f'{name}: число запросов зависит от размера страницы'
+        )
+
+    def test_tags(self):
+        for auth in (False, True):
+            if auth:
+                self.login()
+            prefix = 'auth' if auth else 'anon'
+            self.benchmark(f'{prefix} tags list', '/api/tags/', 1 + auth)
+            self.benchmark(
+                f'{prefix} tags detail', f'/api/tags/{self.tags[0].id}/',
+                1 + auth
+            )
+
+    def test_ingredients(self):
+        for auth in (False, True):
+            if auth:
+                self.login()
+            prefix = 'auth' if auth else 'anon'
+            self.benchmark(
+                f'{prefix} ingredients list', '/api/ingredients/', 1 + auth
+            )
+            self.benchmark(
+                f'{prefix} ingredients search',
+                '/api/ingredients/?name=сол', 1 + auth
+            )
+            self.benchmark(
+                f'{prefix} ingredients detail',
+                f'/api/ingredients/{self.ingredients[0].id}/', 1 + auth
+            )
+
+    def test_recipes_anonymous(self):
+        self.assertPageSizeIndependent('anon recipes list', '/api/recipes/', 2)
+        self.assertPageSizeIndependent(
+            'anon recipes by tags',
+            '/api/recipes/?tags=tag0&tags=tag1', 2
+        )
+        self.benchmark('anon recipes list', '/api/recipes/', 2)
+        self.benchmark(
+            'anon recipes detail', f'/api/recipes/{self.recipe.id}/', 4
+        )
+
+    def test_recipes_cursor(self):
+        self.login()
+        self.assertPageSizeIndependent(
+            'auth recipes cursor', '/api/recipes/?cursor=', 2
+        )
+        expected = list(
+            Recipe.objects.order_by('-pub_date', 'id').values_list(
+                'id', flat=True
+            )
+        )
+        seen = []
+        url = '/api/recipes/?cursor=&limit=7'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(
+                any('COUNT(' in query['sql'] for query in queries)
+            )
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+        self.benchmark('auth recipes cursor', '/api/recipes/?cursor=', 2)
+
+    def test_recipes_authenticated(self):
+        self.login()
+        self.assertPageSizeIndependent('auth recipes list', '/api/recipes/', 3)
+        self.assertPageSizeIndependent(
+            'auth recipes favorited', '/api/recipes/?is_favorited=1', 3
+        )
+        self.assertPageSizeIndependent(
+            'auth recipes in cart', '/api/recipes/?is_in_shopping_cart=1', 3
+        )
+        self.assertPageSizeIndependent(
+            'auth recipes by author',
+            f'/api/recipes/?author={self.authors[0].id}', 4
+        )
+        self.benchmark('auth recipes list', '/api/recipes/', 3)
+        self.benchmark(
+            'auth recipes detail', f'/api/recipes/{self.recipe.id}/', 5
+        )
+
+    def test_heavy_viewer(self):
+        self.login()
+        states = ViewerStateCache(max_users=1, max_ids=0)
+        with patch('api.viewer_state.viewer_states', states):
+            self.assertPageSizeIndependent(
+                'heavy recipes list', '/api/recipes/', 4
+            )
+            self.assertPageSizeIndependent(
+                'heavy users list', '/api/users/', 4
+            )
+            self.benchmark('heavy recipes list', '/api/recipes/', 4)
+
+    def test_recipe_write(self):
+        self.request(
+            'anon recipe create', 'post', '/api/recipes/', {}, status=401,
+            budget=0
+        )
+        self.login()
+        payload = {
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 15,
+            'image': IMAGE, 'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:3]
+            ],
+        }
+        response, _ = self.request(
+            'auth recipe create', 'post', '/api/recipes/', payload,
+            status=201, budget=14
+        )
+        url = f'/api/recipes/{response.data["id"]}/'
+        payload['ingredients'] = [
+            {'id': ingredient.id, 'amount': 20}
+            for ingredient in self.ingredients[1:4]
+        ]
+        response, _ = self.request(
+            'auth recipe update', 'patch', url, payload, budget=20
+        )
+        self.assertEqual(
+            sorted(IngredientRecipe.objects.filter(
+                recipe_id=response.data['id']
+            ).values_list('ingredient_id', 'amount')),
+            [(ingredient.id, 20) for ingredient in self.ingredients[1:4]]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.request(
+                'auth recipe partial update', 'patch', url,
+                {'name': 'Новое название'}, budget=11
+            )
+        self.assertFalse(any(
+            'INSERT' in query['sql'] or 'DELETE' in query['sql']
+            for query in queries
+        ))
+        self.request(
+            'auth recipe delete', 'delete', url, status=204, budget=18
+        )
+
+    def test_recipe_write_scales(self):
+        self.login()
+        self.client.get('/api/recipes/')
+        counts = []
+        for size in (2, 12):
+            payload = {
+                'name': f'Рецепт на {size}', 'text': 'Описание',
+                'cooking_time': 15, 'image': IMAGE,
+                'tags': [tag.id for tag in self.tags],
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 10}
+                    for ingredient in self.ingredients[:size]
+                ],
+            }
+            _, created = self.request(
+                f'auth recipe create {size}', 'post', '/api/recipes/',
+                payload, status=201
+            )
+            counts.append(created)
+        self.assertEqual(
+            counts[0], counts[1],
+            'число запросов зависит от количества ингредиентов'
+        )
+
+    def test_recipe_validation(self):
+        self.login()
+        first, second = self.ingredients[:2]
+        payload = {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 15,
+            'image': IMAGE, 'tags': [self.tags[0].id, 0, self.tags[0].id],
+            'ingredients': [
+                {'id': first.id, 'amount': 10},
+                {'id': 0, 'amount': 10},
+                {'id': first.id, 'amount': 0},
+                {'id': second.id, 'amount': 5},
+            ],
+        }
+        response, _ = self.request(
+            'auth recipe invalid', 'post', '/api/recipes/', payload,
+            status=400, budget=3
+        )
+        self.assertEqual(set(response.data['tags']), {1, 2})
+        errors = response.data['ingredients']
+        self.assertEqual(errors[0], {})
+        self.assertIn('id', errors[1])
+        self.assertEqual(set(errors[2]), {'id', 'amount'})
+        self.assertEqual(errors[3], {})
+
+    def test_favorite_and_shopping_cart(self):
+        self.request(
+            'anon favorite add', 'get',
+            f'/api/recipes/{self.own_recipe.id}/favorite/', status=401,
+            budget=0
+        )
+        self.login()
+        budgets = {'favorite': (9, 7), 'shopping_cart': (14, 14)}
+        for action, (add, remove) in budgets.items():
+            url = f'/api/recipes/{self.recipe.id}/{action}/'
+            self.client.delete(url)
+            for _ in range(BENCHMARK_REPEAT):
+                self.request(f'auth {action} add', 'get', url, budget=add)
+                self.request(
+                    f'auth {action} remove', 'delete', url, status=204,
+                    budget=remove
+                )
+
+    def test_download_shopping_cart(self):
+        self.benchmark(
+            'anon download shopping cart',
+            '/api/recipes/download_shopping_cart/', 0, status=401
+        )
+        self.login()
+        for file_type in ('txt', 'csv', 'html'):
+            response, _ = self.request(
+                f'auth download shopping cart {file_type}', 'get',
+                f'/api/recipes/download_shopping_cart/?type={file_type}',
+                budget=2
+            )
+            self.assertEqual(
+                response['Content-Disposition'],
+                f'attachment; filename="foodgram_shopping_cart.{file_type}"'
+            )
+            self.assertIn(
+                self.ingredients[0].name.encode(), response.streamed
+            )
+        self.benchmark(
+            'auth shopping cart totals', '/api/recipes/shopping_cart_totals/',
+            2
+        )
+        self.request(
+            'auth download shopping cart pdf', 'get',
+            '/api/recipes/download_shopping_cart/?type=pdf', status=400
+        )
+        self.benchmark(
+            'auth download shopping cart',
+            '/api/recipes/download_shopping_cart/', 2
+        )
+
+    def test_users_anonymous(self):
+        self.assertPageSizeIndependent('anon users list', '/api/users/', 2)
+        self.benchmark('anon users list', '/api/users/', 2)
+        self.benchmark(
+            'anon users detail', f'/api/users/{self.authors[0].id}/', 1
+        )
+        self.benchmark('anon users me', '/api/users/me/', 0, status=401)
+        self.benchmark(
+            'anon users subscriptions', '/api/users/subscriptions/', 0,
+            status=401
+        )
+
+    def test_users_authenticated(self):
+        self.login()
+        self.assertPageSizeIndependent('auth users list', '/api/users/', 3)
+        self.benchmark('auth users list', '/api/users/', 3)
+        self.benchmark(
+            'auth users detail', f'/api/users/{self.authors[0].id}/', 3
+        )
+        self.benchmark('auth users me', '/api/users/me/', 2)
+
+    def test_subscriptions(self):
+        self.login()
+        _, few = self.request(
+            'auth subscriptions few', 'get', '/api/users/subscriptions/'
+        )
+        Follow.objects.bulk_create(
+            Follow(user=self.viewer, author=author)
+            for author in self.authors[3:]
+        )
+        response, many = self.request(
+            'auth subscriptions many', 'get',
+            '/api/users/subscriptions/?recipes_limit=3', budget=4
+        )
+        self.assertEqual(few, many)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 3)
+            self.assertEqual(author['recipes_count'], 4)
+        self.benchmark(
+            'auth subscriptions', '/api/users/subscriptions/', 4
+        )
+
+    def test_no_subscriptions(self):
+        self.client.force_authenticate(self.authors[0])
+        response, _ = self.request(
+            'auth subscriptions empty', 'get', '/api/users/subscriptions/',
+            budget=1
+        )
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['results'], [])
+
+    def test_subscribe(self):
+        author = self.authors[-1]
+        url = f'/api/users/{author.id}/subscribe/'
+        self.request('anon subscribe', 'get', url, status=401, budget=0)
+        self.login()
+        for _ in range(BENCHMARK_REPEAT):
+            self.request('auth subscribe', 'get', url, budget=10)
+            self.request(
+                'auth unsubscribe', 'delete', url, status=204, budget=7
+            )
+
+    def test_users_write(self):
+        self.request(
+            'anon user create', 'post', '/api/users/',
+            {
+                'email': 'new@foodgram.ru', 'username': 'newbie',
+                'first_name': 'Новый', 'last_name': 'Пользователь',
+                'password': 'Sup3r-secret-pass',
+            },
+            status=201, budget=4
+        )
+        self.request(
+            'anon token login', 'post', '/api/auth/token/login/',
+            {'email': 'new@foodgram.ru', 'password': 'Sup3r-secret-pass'},
+            budget=6
+        )
+        self.login()
+        self.request(
+            'auth set password', 'post', '/api/users/set_password/',
+            {
+                'current_password': 'viewer-pass',
+                'new_password': 'An0ther-secret-pass',
+            },
+            status=204, budget=9
+        )
+        self.request(
+            'auth token logout', 'post', '/api/auth/token/logout/',
+            status=204, budget=2
+        )
+
+    def test_health(self):
+        self.benchmark('anon health', '/api/health/', budget=1)
+        User.objects.filter(pk=self.viewer.pk).update(is_staff=True)
+        self.login()
+        response, _ = self.request(
+            'staff health', 'get', '/api/health/', budget=2
+        )
+        self.assertIn('connections', response.data)
+
+    def test_image_upload(self):
+        # Загрузки без рецепта остались бы в общем TEMP_MEDIA_ROOT.
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        content = base64.b64decode(IMAGE.split(',')[1])
+        url = '/api/recipes/images/'
+        self.request('anon image upload', 'post', url, status=401, budget=0)
+        self.login()
+        with self.settings(MEDIA_ROOT=media_root):
+            for _ in range(BENCHMARK_REPEAT):
+                self.request(
+                    'auth image upload', 'post', url,
+                    {'image': SimpleUploadedFile('image.png', content)},
+                    status=201, budget=1, format='multipart'
+                )
+
+    @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+    @patch('recipes.thumbnails.executor')
+    def test_recipe_import(self, executor):
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'recipes/images'),
+                    exist_ok=True)
+        with open(os.path.join(TEMP_MEDIA_ROOT, 'recipes/images/import.png'),
+                  'wb') as f:
+            f.write(base64.b64decode(IMAGE.split(',')[1]))
+        record = json.dumps({
+            'name': 'Импорт', 'text': 'Описание', 'cooking_time': 10,
+            'image': 'recipes/images/import.png',
+            'tags': [tag.slug for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 5}
+                for ingredient in self.ingredients[:INGREDIENTS_PER_RECIPE]
+            ],
+        }, ensure_ascii=False)
+        url = '/api/recipes/import/'
+        self.request(
+            'anon recipe import', 'post', url, record, status=401, budget=0,
+            content_type='application/x-ndjson'
+        )
+        self.login()
+        counts = []
+        for size in (SMALL_PAGE, LARGE_PAGE):
+            response, queries = self.request(
+                f'auth recipe import {size}', 'post', url,
+                '\n'.join([record] * size), status=201, budget=10,
+                content_type='application/x-ndjson'
+            )
+            self.assertEqual(response.data['created'], size, response.data)
+            counts.append(queries)
+        self.assertEqual(
+            counts[0], counts[1],
+            'recipe import: число запросов зависит от числа рецептов'
+        )
+
+
+class ViewerStateTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.viewer)
+
+    def flags(self):
+        data = self.client.get(f'/api/recipes/{self.recipe.id}/').data
+        return (
+            data['is_favorited'], data['is_in_shopping_cart'],
+            data['author']['is_subscribed']
+        )
+
+    def toggle_all(self, method):
+        for url in (
+            f'/api/recipes/{self.recipe.id}/favorite/',
+            f'/api/recipes/{self.recipe.id}/shopping_cart/',
+            f'/api/users/{self.author.id}/subscribe/',
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                getattr(self.client, method)(url)
+
+    def test_writes_invalidate_state(self):
+        self.assertEqual(self.flags(), (False, False, False))
+        self.toggle_all('get')
+        self.assertEqual(self.flags(), (True, True, True))
+        self.toggle_all('delete')
+        self.assertEqual(self.flags(), (False, False, False))
+
+    def test_orm_writes_invalidate_state(self):
+        self.assertEqual(self.flags(), (False, False, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.viewer, recipe=self.recipe)
+            ShoppingCart.objects.create(user=self.viewer, recipe=self.recipe)
+            Follow.objects.create(user=self.viewer, author=self.author)
+        self.assertEqual(self.flags(), (True, True, True))
+        with self.captureOnCommitCallbacks(execute=True):
+            for model in (Favorite, ShoppingCart, Follow):
+                model.objects.filter(user=self.viewer).delete()
+        self.assertEqual(self.flags(), (False, False, False))
+
+    def test_heavy_user_falls_back_to_annotations(self):
+        self.toggle_all('get')
+        states = ViewerStateCache(max_users=1, max_ids=1)
+        self.assertIsNone(states.get(self.viewer.id))
+        with patch('api.viewer_state.viewer_states', states):
+            self.assertEqual(self.flags(), (True, True, True))
+            users = self.client.get('/api/users/').data['results']
+            self.assertEqual(
+                {user['id']: user['is_subscribed'] for user in users},
+                {self.viewer.id: False, self.author.id: True}
+            )
+
+    def test_lru_eviction(self):
+        states = ViewerStateCache(max_users=1, max_ids=10)
+        states.get(self.viewer.id)
+        states.get(self.author.id)
+        self.assertEqual(list(states._states), [self.author.id])
+
+
+class IngredientSearchTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, unit='г') for name in (
+                'Соль', 'соль морская', 'морская соль', 'Ёжевика',
+                'свёкла', 'фасоль', 'сахар',
+            )
+        )
+
+    def names(self, query, limit=10):
+        response = self.client.get('/api/ingredients/', {'name': query})
+        return [item['name'] for item in response.data][:limit]
+
+    def test_prefix_matches_rank_first(self):
+        self.assertEqual(
+            self.names('сол'),
+            ['Соль', 'соль морская', 'фасоль', 'морская соль']
+        )
+
+    def test_case_folding_and_yo(self):
+        self.assertEqual(self.names('СВЕКЛ'), ['свёкла'])
+        self.assertEqual(self.names('ежев'), ['Ёжевика'])
+        self.assertEqual(self.names('ёжев'), ['Ёжевика'])
+
+    def test_result_count_is_capped(self):
+        with self.settings(INGREDIENT_SEARCH_LIMIT=2):
+            self.assertEqual(self.names('со'), ['Соль', 'соль морская'])
+
+    def test_index_rebuilt_on_change(self):
+        self.assertEqual(self.names('сах'), ['сахар'])
+        Ingredient.objects.create(name='сахарная пудра', unit='г')
+        self.assertEqual(self.names('сах'), ['сахар', 'сахарная пудра'])
+        Ingredient.objects.filter(name='сахар').get().delete()
+        self.assertEqual(self.names('сах'), ['сахарная пудра'])
+
+    def test_catalog_search(self):
+        path = os.path.join(settings.BASE_DIR, 'recipes/data/ingredients.csv')
+        with open(path, encoding='utf-8') as f:
+            index = IngredientIndex(
+                {'id': number, 'name': name, 'measurement_unit': unit}
+                for number, (name, unit) in enumerate(csv.reader(f))
+            )
+        grams = len(index.grams)
+        queries = ('с', 'со', 'мол', 'сыр', 'масло', 'перец чер', 'ово')
+        start = time.perf_counter()
+        for query in queries:
+            found = index.search(query, settings.INGREDIENT_SEARCH_LIMIT)
+            self.assertTrue(found, query)
+            self.assertTrue(all(
+                query in normalize(item['name']) for item in found
+            ), query)
+        TIMINGS['ingredient index search'].append(
+            (time.perf_counter() - start) / len(queries)
+        )
+        for query in ('qzx', 'перец qzx', 'ъъъъ'):
+            self.assertEqual(index.search(query, 10), [])
+        self.assertEqual(len(index.grams), grams)
+
+
+class ConditionalResponseTest(RecipeTestCase):
+
+    def revalidate(self, url, etag, queries=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        if queries is not None:
+            self.assertLessEqual(len(captured), queries)
+        return response
+
+    def test_catalog_not_modified(self):
+        for url in ('/api/tags/', '/api/ingredients/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response)
+            etag = response['ETag']
+            not_modified = self.revalidate(url, etag, queries=0)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified['ETag'], etag)
+        etag = self.client.get('/api/tags/')['ETag']
+        self.create_tag('lunch')
+        self.assertEqual(self.revalidate('/api/tags/', etag).status_code, 200)
+
+    def test_recipe_not_modified(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag, queries=1).status_code,
+                         304)
+        self.recipe.save()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_invalid_id(self):
+        for url in ('/api/recipes/abc/', '/api/recipes/999999/'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+    def test_personalized_recipe(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        anonymous = self.client.get(url)['ETag']
+        self.client.force_authenticate(self.viewer)
+        response = self.client.get(url)
+        self.assertNotEqual(response['ETag'], anonymous)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/api/recipes/{self.recipe.id}/favorite/')
+        response = self.revalidate(url, response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ResponseCacheTest(RecipeTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tags = [cls.tag, cls.create_tag('lunch')]
+        TagRecipe.objects.create(recipe=cls.recipe, tag=cls.tags[1])
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_anonymous_reads_are_cached(self):
+        for url in ('/api/recipes/?tags=breakfast&tags=lunch',
+                    f'/api/recipes/{self.recipe.id}/', '/api/tags/'):
+            response, _ = self.queries(url)
+            cached, queries = self.queries(url)
+            self.assertEqual(cached.data, response.data)
+            self.assertLessEqual(queries, 1, url)
+        _, queries = self.queries('/api/recipes/?tags=lunch&tags=breakfast')
+        self.assertEqual(queries, 0)
+
+    def test_writes_invalidate(self):
+        url = '/api/recipes/'
+        self.queries(url)
+        self.client.force_authenticate(self.author)
+        self.client.post(url, {
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 15,
+            'image': IMAGE, 'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.salt.id, 'amount': 10}],
+        }, format='json')
+        self.client.force_authenticate(None)
+        response, queries = self.queries(url)
+        self.assertGreater(queries, 0)
+        self.assertEqual(response.data['count'], 2)
+        self.queries('/api/tags/')
+        Tag.objects.filter(pk=self.tags[0].pk).get().save()
+        self.assertGreater(self.queries('/api/tags/')[1], 0)
+        self.queries(url)
+        self.author.save(update_fields=['last_login'])
+        self.create_user('newcomer')
+        self.assertEqual(self.queries(url)[1], 0)
+        self.author.first_name = 'Повар'
+        self.author.save()
+        response, _ = self.queries(url)
+        self.assertEqual(
+            response.data['results'][0]['author']['first_name'], 'Повар'
+        )
+
+    def test_blank_cursor_is_not_page_number(self):
+        self.assertIn('count', self.client.get('/api/recipes/').data)
+        response = self.client.get('/api/recipes/?cursor=')
+        self.assertNotIn('count', response.data)
+        self.assertIn('results', response.data)
+
+    def test_tag_filter(self):
+        url = '/api/recipes/?tags=breakfast&tags=lunch'
+        self.assertEqual(self.client.get(url).data['count'], 1)
+        Favorite.objects.create(user=self.author, recipe=self.recipe)
+        self.client.force_authenticate(self.author)
+        response = self.client.get(f'{url}&is_favorited=1')
+        self.assertEqual(response.data['count'], 1)
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/recipes/?tags=dinner')
+        self.assertEqual(response.status_code, 400)
+        self.create_tag('dinner')
+        response = self.client.get('/api/recipes/?tags=dinner')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_warm_cache(self):
+        call_command('warm_cache', '--host', 'testserver', stdout=StringIO())
+        for url in ('/api/tags/', '/api/recipes/?page=1&limit=6',
+                    '/api/recipes/?page=1&limit=6&tags=breakfast&tags=lunch'):
+            self.assertEqual(self.queries(url)[1], 0, url)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.author)
+        patcher = patch('recipes.thumbnails.executor')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create(self, image):
+        return self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 5,
+            'image': image, 'tags': [self.tag.id],
+            'ingredients': [{'id': self.salt.id, 'amount': 1}],
+        }, format='json')
+
+    def upload(self, content, name='image.png'):
+        return self.client.post(
+            '/api/recipes/images/',
+            {'image': SimpleUploadedFile(name, content)}, format='multipart'
+        )
+
+    def test_base64(self):
+        header, data = IMAGE.split(',')
+        wrapped = '\n'.join(data[i:i + 10] for i in range(0, len(data), 10))
+        response = self.create(f'{header},{wrapped}')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertTrue(response.data['image'].endswith('.png'))
+
+    def test_limits(self):
+        with self.settings(IMAGE_UPLOAD_MAX_SIZE=10):
+            self.assertEqual(self.create(IMAGE).status_code, 400)
+        with self.settings(IMAGE_UPLOAD_MAX_PIXELS=0):
+            self.assertEqual(self.create(IMAGE).status_code, 400)
+        not_image = base64.b64encode(b'not an image').decode()
+        self.assertEqual(self.create(not_image).status_code, 400)
+        self.assertEqual(self.create('broken base64=').status_code, 400)
+
+    def test_upload_by_id(self):
+        content = base64.b64decode(IMAGE.split(',')[1])
+        self.assertEqual(self.upload(b'not an image').status_code, 400)
+        upload_id = self.upload(content).data['id']
+        self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.create(upload_id).status_code, 400)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create(upload_id)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'recipes/uploads')), []
+        )
+        self.client.force_authenticate(None)
+        self.assertEqual(self.upload(content).status_code, 401)
+
+    def test_decoding_memory_is_bounded(self):
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (1000, 1000), os.urandom(3000000)).save(
+            buffer, 'PNG'
+        )
+        data = base64.b64encode(buffer.getvalue()).decode()
+        tracemalloc.start()
+        try:
+            file = images.decode_base64(data)
+            images.check_image(file)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        file.close()
+        self.assertGreater(len(data), 3000000)
+        self.assertLess(peak, 1000000)
+
+
+class RecipeSnapshotTest(RecipeTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe.thumbnails = {'small': {'webp': 'cache/small.webp'}}
+        cls.recipe.save()
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get(self, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        tables = {'recipes_tagrecipe', 'recipes_ingredientrecipe'}
+        rebuilt = any(
+            table in query['sql'] for query in queries for table in tables
+        )
+        return response.data, rebuilt
+
+    def test_snapshot_is_shared_between_viewers(self):
+        self.client.force_authenticate(self.viewer)
+        self.client.get(f'{self.url}favorite/')
+        self.client.get(f'/api/users/{self.author.id}/subscribe/')
+        data, rebuilt = self.get(self.viewer)
+        self.assertTrue(rebuilt)
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+        self.assertEqual(
+            data['image'], 'http://testserver/media/recipes/images/test.png'
+        )
+        self.assertEqual(
+            data['thumbnails'],
+            {'small': {'webp': 'http://testserver/media/cache/small.webp'}}
+        )
+        data, rebuilt = self.get(self.author)
+        self.assertFalse(rebuilt)
+        self.assertFalse(data['is_favorited'])
+        self.assertFalse(data['author']['is_subscribed'])
+        self.assertEqual(data['tags'][0]['slug'], 'breakfast')
+        self.assertEqual(data['ingredients'][0]['amount'], 5)
+
+    def test_changes_rebuild_snapshot(self):
+        self.get(self.viewer)
+        self.client.force_authenticate(self.author)
+        self.client.patch(self.url, {
+            'ingredients': [{'id': self.salt.id, 'amount': 7}],
+        }, format='json')
+        data, rebuilt = self.get(self.viewer)
+        self.assertTrue(rebuilt)
+        self.assertEqual(data['ingredients'][0]['amount'], 7)
+        changes = (
+            (self.tag, 'name', 'Ужин', lambda data: data['tags'][0]['name']),
+            (self.salt, 'name', 'морская соль',
+             lambda data: data['ingredients'][0]['name']),
+            (self.author, 'first_name', 'Повар',
+             lambda data: data['author']['first_name']),
+        )
+        for instance, field, value, shown in changes:
+            setattr(instance, field, value)
+            instance.save()
+            data, rebuilt = self.get(self.viewer)
+            self.assertTrue(rebuilt, field)
+            self.assertEqual(shown(data), value)
+            self.assertFalse(self.get(self.viewer)[1])
+        self.viewer.set_password('new-viewer-pass')
+        self.viewer.save(update_fields=['password'])
+        self.author.save(update_fields=['last_login'])
+        self.assertFalse(self.get(self.viewer)[1])
+        self.tag.delete()
+        data, rebuilt = self.get(self.viewer)
+        self.assertTrue(rebuilt)
+        self.assertEqual(data['tags'], [])
+
+    def test_admin_row_changes_rebuild_snapshot(self):
+        admin = User.objects.create_superuser(
+            email='admin@foodgram.ru', username='admin', password='admin-pass'
+        )
+        dinner = self.create_tag('dinner')
+        self.get(self.viewer)
+        self.client.force_authenticate(None)
+        anonymous = self.client.get(self.url).data
+        self.client.force_login(admin)
+        response = self.client.post('/admin/recipes/tagrecipe/add/', {
+            'recipe': self.recipe.id, 'tag': dinner.id,
+        })
+        self.assertEqual(response.status_code, 302)
+        data, rebuilt = self.get(self.viewer)
+        self.assertTrue(rebuilt)
+        self.assertEqual(
+            [tag['slug'] for tag in data['tags']], ['breakfast', 'dinner']
+        )
+        self.client.logout()
+        self.assertNotEqual(self.client.get(self.url).data, anonymous)
+        row = TagRecipe.objects.get(tag=dinner)
+        self.client.force_login(admin)
+        self.client.post(
+            f'/admin/recipes/tagrecipe/{row.pk}/delete/', {'post': 'yes'}
+        )
+        data, rebuilt = self.get(self.viewer)
+        self.assertTrue(rebuilt)
+        self.assertEqual([tag['slug'] for tag in data['tags']], ['breakfast'])
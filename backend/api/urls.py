@@ -15,5 +15,21 @@ urlpatterns = [
         utils.download_shopping_cart,
         name='ownload_shopping_cart'
     ),
+    path(
+        'recipes/shopping_cart_totals/',
+        utils.shopping_cart_totals,
+        name='shopping_cart_totals'
+    ),
+    path(
+        'recipes/import/',
+        utils.import_recipes,
+        name='import_recipes'
+    ),
+    path(
+        'recipes/images/',
+        utils.upload_recipe_image,
+        name='upload_recipe_image'
+    ),
+    path('health/', utils.health, name='health'),
     path('', include(router.urls)),
 ]
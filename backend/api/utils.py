@@ -1,35 +1,191 @@
-from django.db.models import F, Sum
-from django.http.response import HttpResponse
+import csv
+from html import escape
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.http.response import StreamingHttpResponse
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
-from recipes.models import IngredientRecipe
+from foodgram.connections import stats as connection_stats
+from recipes.importer import RecipeImporter
+
+from .images import save_upload
+from .serializers import ShoppingListItemSerializer
+
+CHUNK_SIZE = 2000
+MULTIPART_OVERHEAD = 16 * 1024
+
+HTML_HEAD = (
+    '<!DOCTYPE html>\n<html lang="ru">\n<head>\n<meta charset="utf-8">\n'
+    '<title>Список покупок</title>\n<style>\n'
+    'body { font-family: sans-serif; margin: 2em; }\n'
+    'table { border-collapse: collapse; width: 100%; }\n'
+    'td, th { border-bottom: 1px solid #ccc; padding: .4em; '
+    'text-align: left; }\n'
+    'td:first-child::before { content: "\\2610  "; }\n'
+    '@media print { body { margin: 0; } }\n'
+    '</style>\n</head>\n<body>\n<h1>Список покупок</h1>\n<table>\n'
+    '<tr><th>Ингредиент</th><th>Единица измерения</th>'
+    '<th>Количество</th></tr>\n'
+)
+HTML_TAIL = '</table>\n</body>\n</html>\n'
+
+
+def shopping_list_items(user):
+    return user.shopping_list.order_by('-total', 'ingredient__name')
+
+
+def shopping_list(user):
+    return shopping_list_items(user).values(
+        'total', name=F('ingredient__name'), unit=F('ingredient__unit'),
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def render_txt(items):
+    for item in items:
+        yield f"{item['name']} ({item['unit']}) - {item['total']}\n"
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(
+        ('Ингредиент', 'Единица измерения', 'Количество')
+    )
+    for item in items:
+        yield writer.writerow((item['name'], item['unit'], item['total']))
+
+
+def render_html(items):
+    yield HTML_HEAD
+    for item in items:
+        yield (
+            f"<tr><td>{escape(item['name'])}</td>"
+            f"<td>{escape(item['unit'])}</td><td>{item['total']}</td></tr>\n"
+        )
+    yield HTML_TAIL
+
+
+EXPORT_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'html': ('text/html; charset=utf-8', render_html),
+}
 
 
 @api_view(['GET'])
 def download_shopping_cart(request):
     user = request.user
     if not user.is_anonymous:
-        shopping_cart = user.customer.all()
-        recipes = shopping_cart.values('recipe').all()
-        ingredients = IngredientRecipe.objects.filter(recipe_id__in=recipes)
-        shopping_list = ingredients.values(
-            'ingredient__name', 'ingredient__unit', 'amount'
-        ).annotate(
-            name=F('ingredient__name'),
-            unit=F('ingredient__unit'),
-            total=Sum('amount'),
-        ).order_by('-total')
-        text = '\n'.join([
-            f"{item['name']} ({item['unit']}) - {item['total']}"
-            for item in shopping_list
-        ])
-        filename = "foodgram_shopping_cart.txt"
-        response = HttpResponse(text, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment: filename={filename}'
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in EXPORT_FORMATS:
+            return Response(
+                data={"errors": "Доступные форматы: {}".format(
+                    ', '.join(EXPORT_FORMATS)
+                )},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content_type, render = EXPORT_FORMATS[file_type]
+        filename = f'foodgram_shopping_cart.{file_type}'
+        response = StreamingHttpResponse(
+            render(shopping_list(user)), content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"'
+        )
         return response
     return Response(
+        data={"detail": "Учетные данные не были предоставлены"},
+        status=status.HTTP_401_UNAUTHORIZED,
+    )
+
+
+@api_view(['GET'])
+def shopping_cart_totals(request):
+    user = request.user
+    if not user.is_anonymous:
+        serializer = ShoppingListItemSerializer(
+            shopping_list_items(user).select_related('ingredient'), many=True
+        )
+        return Response(serializer.data)
+    return Response(
+        data={"detail": "Учетные данные не были предоставлены"},
+        status=status.HTTP_401_UNAUTHORIZED,
+    )
+
+
+@api_view(['POST'])
+@parser_classes([MultiPartParser])
+def upload_recipe_image(request):
+    """Принимает картинку multipart-запросом: Django пишет её на диск
+    по кускам, id загрузки затем передаётся в поле image рецепта."""
+    if request.user.is_anonymous:
+        return Response(
             data={"detail": "Учетные данные не были предоставлены"},
             status=status.HTTP_401_UNAUTHORIZED,
         )
+    length = int(request.META.get('CONTENT_LENGTH') or 0)
+    if length > settings.IMAGE_UPLOAD_MAX_SIZE + MULTIPART_OVERHEAD:
+        return Response(
+            data={"errors": "Картинка больше {} байт".format(
+                settings.IMAGE_UPLOAD_MAX_SIZE
+            )},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    image = request.FILES.get('image')
+    if image is None:
+        return Response(
+            data={"image": ["Обязательное поле."]},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        upload_id = save_upload(image, request.user)
+    except ValidationError as error:
+        return Response(
+            data={"image": error.detail},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response({"id": upload_id}, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+def import_recipes(request):
+    """Импорт рецептов текущего пользователя из NDJSON.
+
+    Тело читается построчно из потока запроса, не целиком.
+    """
+    if request.user.is_anonymous:
+        return Response(
+            data={"detail": "Учетные данные не были предоставлены"},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+    report = RecipeImporter(request.user).run(request.stream or [])
+    if report['errors'] and not report['created']:
+        return Response(report, status=status.HTTP_400_BAD_REQUEST)
+    return Response(report, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+def health(request):
+    """Доступность БД для балансировщика, персоналу — ещё и счётчики
+    соединений процесса."""
+    data, code = {"database": "ok"}, status.HTTP_200_OK
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError:
+        data, code = {"database": "unavailable"}, (
+            status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    if request.user.is_staff:
+        data["connections"] = connection_stats()
+    return Response(data, status=code)
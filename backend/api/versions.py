@@ -0,0 +1,31 @@
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+
+def new_version():
+    return '{}.{}'.format(int(time.time()), uuid4().hex)
+
+
+def get_version(key):
+    """Текущая версия данных из общего кэша.
+
+    Версия — случайный токен, а не счётчик: после вытеснения ключа из
+    кэша новая версия не совпадёт ни с одной закэшированной копией.
+    Токен начинается со времени изменения.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def version_time(version):
+    """Время изменения, записанное в токене версии."""
+    return int(version.split('.', 1)[0])
+
+
+def bump_version(key):
+    cache.set(key, new_version(), None)
@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import IntegerField, Value
+
+from recipes.models import Favorite, Follow, ShoppingCart
+
+from .versions import bump_version, get_version
+
+VERSION_KEY = 'viewer-state:{}'
+
+FAVORITES, SHOPPING_CART, FOLLOWING = range(3)
+
+
+class ViewerState:
+    """Рецепты в избранном и в корзине и авторы, на которых подписан
+    пользователь, с отметкой версии."""
+
+    __slots__ = ('version', 'favorites', 'shopping_cart', 'following')
+
+    def __init__(self, version, favorites, shopping_cart, following):
+        self.version = version
+        self.favorites = favorites
+        self.shopping_cart = shopping_cart
+        self.following = following
+
+
+def load_state(user_id, version, max_ids):
+    """Загружает все связи пользователя одним запросом.
+
+    Возвращает None, если связей больше max_ids: такие пользователи
+    не кэшируются, флаги для них считаются в запросе к рецептам.
+    """
+    kind = IntegerField()
+    rows = Favorite.objects.filter(user_id=user_id).values_list(
+        Value(FAVORITES, output_field=kind), 'recipe_id'
+    ).union(
+        ShoppingCart.objects.filter(user_id=user_id).values_list(
+            Value(SHOPPING_CART, output_field=kind), 'recipe_id'
+        ),
+        Follow.objects.filter(user_id=user_id).values_list(
+            Value(FOLLOWING, output_field=kind), 'author_id'
+        ),
+        all=True,
+    )
+    rows = list(rows[:max_ids + 1])
+    if len(rows) > max_ids:
+        return None
+    ids = (set(), set(), set())
+    for kind, object_id in rows:
+        ids[kind].add(object_id)
+    return ViewerState(version, *map(frozenset, ids))
+
+
+class ViewerStateCache:
+    """LRU-кэш состояний пользователей в памяти процесса.
+
+    Версии хранятся в кэше Django. Копии в других воркерах устаревают
+    после записи, только если кэш общий (memcached, Redis): с кэшем
+    в памяти процесса gunicorn не запускает больше одного воркера
+    (foodgram.startup.shared_cache_error).
+    """
+
+    def __init__(self, max_users, max_ids):
+        self.max_users = max_users
+        self.max_ids = max_ids
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        version = get_version(VERSION_KEY.format(user_id))
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None and state.version == version:
+                self._states.move_to_end(user_id)
+                return state
+        state = load_state(user_id, version, self.max_ids)
+        with self._lock:
+            if state is None:
+                self._states.pop(user_id, None)
+                return None
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+        return state
+
+    def invalidate(self, user_id):
+        bump_version(VERSION_KEY.format(user_id))
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+
+viewer_states = ViewerStateCache(
+    max_users=settings.VIEWER_STATE_CACHE['MAX_USERS'],
+    max_ids=settings.VIEWER_STATE_CACHE['MAX_IDS'],
+)
+
+
+def get_viewer_state(request):
+    """Состояние текущего пользователя, загружается один раз на запрос."""
+    if request is None or request.user.is_anonymous:
+        return None
+    if not hasattr(request, '_viewer_state'):
+        request._viewer_state = viewer_states.get(request.user.id)
+    return request._viewer_state
+
+
+def invalidate_viewer_state(user_id):
+    viewer_states.invalidate(user_id)
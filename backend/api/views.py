@@ -1,3 +1,7 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import decorators, status, viewsets
@@ -5,26 +9,72 @@ from rest_framework.response import Response
 
 from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 
-from .filters import IngredientFilter, RecipeFilter
+from .conditional import (TAGS_VERSION, Validators, catalog,
+                          conditional_response)
+from .filters import RecipeFilter
+from .pagination import RecipePagination
 from .permissions import IsAuthor
+from .querysets import is_favorited, is_in_shopping_cart, recipe_queryset
+from .response_cache import RECIPES_VERSION, cached_response
+from .search import VERSION_KEY as INGREDIENTS_VERSION
+from .search import ingredient_search
 from .serializers import (FavoriteSerializer, FavoriteShoppingSerializer,
                           IngredientSerializer, RecipeListSerializer,
                           RecipeSerializer, ShoppingCartSerializer,
                           TagSerializer)
 
+RECIPE_VERSIONS = (RECIPES_VERSION, TAGS_VERSION, INGREDIENTS_VERSION)
+
+
+def catalog_response(request, version, respond):
+    return conditional_response(
+        request, catalog(version),
+        partial(cached_response, request, (version,), respond)
+    )
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     pagination_class = None
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        return catalog_response(
+            request, TAGS_VERSION,
+            partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(
+            request, TAGS_VERSION,
+            partial(super().retrieve, request, *args, **kwargs)
+        )
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     pagination_class = None
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
+
+    def list(self, request, *args, **kwargs):
+        return catalog_response(
+            request, INGREDIENTS_VERSION,
+            partial(self.search, request, *args, **kwargs)
+        )
+
+    def search(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_search.search(
+                name, settings.INGREDIENT_SEARCH_LIMIT
+            ))
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(
+            request, INGREDIENTS_VERSION,
+            partial(super().retrieve, request, *args, **kwargs)
+        )
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -32,22 +82,57 @@ class RecipeViewSet(viewsets.ModelViewSet):
     serializer_class = RecipeListSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
     lookup_field = 'id'
+    # retrieve читает рецепт по id до get_object: нечисловой id — 404.
+    lookup_value_regex = r'\d+'
 
     def get_queryset(self):
-        qs = super().get_queryset()
         user = self.request.user
-        if not user.is_anonymous:
-            if self.request.query_params.get('is_favorited'):
-                qs = qs.filter(favorite__user=user)
-            if self.request.query_params.get('is_in_shopping_cart'):
-                qs = qs.filter(purchase__user=user)
+        qs = recipe_queryset(
+            super().get_queryset(), self.action, self.request
+        )
+        if user.is_anonymous or self.action != 'list':
             return qs
+        if self.request.query_params.get('is_favorited'):
+            qs = qs.filter(is_favorited(user))
+        if self.request.query_params.get('is_in_shopping_cart'):
+            qs = qs.filter(is_in_shopping_cart(user))
         return qs
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request, RECIPE_VERSIONS,
+            partial(super().list, request, *args, **kwargs),
+            anonymous_only=True
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        respond = partial(
+            cached_response, request, RECIPE_VERSIONS,
+            partial(super().retrieve, request, *args, **kwargs),
+            anonymous_only=True
+        )
+        row = Recipe.objects.filter(id=kwargs['id']).values_list(
+            'updated_at', 'author__username', 'author__first_name',
+            'author__last_name', 'author__email'
+        ).first()
+        if row is None:
+            return respond()
+        updated_at, *author = row
+        validators = Validators().add(kwargs['id']).add(
+            updated_at.isoformat(), updated_at.timestamp()
+        ).add('|'.join(author))
+        validators.add_version(TAGS_VERSION)
+        validators.add_version(INGREDIENTS_VERSION)
+        validators.add_viewer(request.user)
+        return conditional_response(
+            request, validators, respond, personalized=True
+        )
+
     def get_serializer_class(self):
         if self.action == 'list' or self.action == 'retrieve':
             return RecipeListSerializer
@@ -79,17 +164,24 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer_val = FavoriteSerializer(
                 data={'user': user_pk, 'recipe': recipe_id})
             serializer_val.is_valid(raise_exception=True)
-            serializer_val.save()
+            with transaction.atomic():
+                serializer_val.save()
             serializer = FavoriteShoppingSerializer(recipe)
             return Response(serializer.data)
-        favorite = Favorite.objects.filter(user=user, recipe=recipe)
-        if favorite.exists():
-            favorite.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(
-            data={"errors": "No recipe in favorite"},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
+        # Удаление экземпляра: сигнал post_delete сбросит состояние
+        # пользователя и счётчик, а запросов столько же, сколько у exists().
+        with transaction.atomic():
+            favorite = Favorite.objects.select_for_update().filter(
+                user=user, recipe=recipe
+            ).first()
+            if favorite is not None:
+                favorite.delete()
+        if favorite is None:
+            return Response(
+                data={"errors": "No recipe in favorite"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @decorators.action(
         ['GET', 'DELETE'],
@@ -105,14 +197,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer_val = ShoppingCartSerializer(
                 data={'user': user_pk, 'recipe': recipe_id})
             serializer_val.is_valid(raise_exception=True)
-            serializer_val.save()
+            # Список покупок обновляет сигнал в той же транзакции.
+            with transaction.atomic():
+                serializer_val.save()
             serializer = FavoriteShoppingSerializer(recipe)
             return Response(serializer.data)
-        shop_cart = ShoppingCart.objects.filter(user=user, recipe=recipe)
-        if shop_cart.exists():
-            shop_cart.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(
-            data={"errors": "No recipe in shopping cart"},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
+        with transaction.atomic():
+            # Параллельное удаление той же корзины ждёт блокировку и не
+            # вычтет рецепт из списка покупок второй раз.
+            shop_cart = ShoppingCart.objects.select_for_update().filter(
+                user=user, recipe=recipe
+            ).first()
+            if shop_cart is not None:
+                shop_cart.delete()
+        if shop_cart is None:
+            return Response(
+                data={"errors": "No recipe in shopping cart"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
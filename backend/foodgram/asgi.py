@@ -11,6 +11,15 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from foodgram import connections
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Под ASGI соединения открываются в потоках sync_to_async, а не воркера,
+# и не переиспользуются предсказуемо: постоянные соединения выключены,
+# пул держит внешний пулер (PgBouncer), адрес которого задаёт DB_HOST.
+# DB_CONN_MAX_AGE из .env здесь не действует.
+os.environ['DJANGO_ASGI'] = 'true'
 
 application = get_asgi_application()
+
+connections.install()
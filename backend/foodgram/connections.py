@@ -0,0 +1,91 @@
+"""Постоянные соединения с БД в процессах gunicorn.
+
+Django держит по соединению на поток и переиспользует его CONN_MAX_AGE
+секунд. Здесь к этому добавлены проверка простоявшего соединения перед
+запросом и счётчики соединений процесса.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Счётчики соединений текущего процесса."""
+    with _lock:
+        return dict(_stats)
+
+
+def idle_connections():
+    """Открытые соединения потока вне транзакции."""
+    for connection in connections.all():
+        if connection.connection is not None and (
+            not connection.in_atomic_block
+        ):
+            yield connection
+
+
+def connection_opened(sender, connection, **kwargs):
+    count('opened')
+
+
+def close_obsolete_connections():
+    """Закрывает устаревшие соединения и сломанные ошибкой БД."""
+    for connection in idle_connections():
+        errors_occurred = connection.errors_occurred
+        connection.close_if_unusable_or_obsolete()
+        if connection.connection is None:
+            count('closed_after_error' if errors_occurred else 'expired')
+
+
+def release_connections(**kwargs):
+    close_obsolete_connections()
+    for connection in idle_connections():
+        connection.released_at = time.monotonic()
+
+
+def check_connections(**kwargs):
+    """Проверяет соединения перед повторным использованием.
+
+    Соединение, отданное меньше DB_HEALTH_CHECK_IDLE секунд назад, не
+    проверяется: за это время сервер его вряд ли закрыл, а лишний
+    SELECT 1 удлинил бы каждый запрос.
+    """
+    close_obsolete_connections()
+    now = time.monotonic()
+    for connection in idle_connections():
+        if not connection.settings_dict.get('CONN_HEALTH_CHECKS'):
+            continue
+        released_at = getattr(connection, 'released_at', None)
+        if released_at is not None and (
+            now - released_at < settings.DB_HEALTH_CHECK_IDLE
+        ):
+            count('reused')
+        elif connection.is_usable():
+            count('checked')
+            count('reused')
+        else:
+            count('check_failed')
+            connection.close()
+
+
+def install():
+    """Подменяет обработчик Django close_old_connections на проверку
+    с подсчётом. Вызывается из wsgi.py и asgi.py."""
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    request_started.connect(check_connections)
+    request_finished.connect(release_connections)
+    connection_created.connect(connection_opened)
@@ -0,0 +1,117 @@
+"""Общие данные тестов: фабрики пользователей, тегов и рецептов,
+базовый класс с типовым набором данных и сбор замеров времени."""
+import atexit
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+from collections import defaultdict
+
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag, TagRecipe
+from users.models import User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, TEMP_MEDIA_ROOT, ignore_errors=True)
+
+# Путь к JSON-файлу с перцентилями; без него замеры не сохраняются.
+BENCHMARK_OUTPUT = os.getenv('BENCHMARK_OUTPUT')
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAD'
+    'UlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+TAGS = {
+    'breakfast': ('Завтрак', '#E26C2D'),
+    'lunch': ('Обед', '#49B64E'),
+    'dinner': ('Ужин', '#8775D2'),
+}
+
+TIMINGS = defaultdict(list)
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def write_benchmark():
+    """Пишет все замеры процесса: файл перезаписывается после каждого
+    модуля тестов и в конце содержит замеры всех модулей."""
+    if not BENCHMARK_OUTPUT or not TIMINGS:
+        return
+    report = {
+        name: {
+            'runs': len(values),
+            'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+            'p90_ms': round(percentile(values, 0.9) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'mean_ms': round(statistics.mean(values) * 1000, 3),
+        }
+        for name, values in sorted(TIMINGS.items())
+    }
+    with open(BENCHMARK_OUTPUT, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def quiet_request_log():
+    # Строка лога на каждый запрос засорила бы вывод тестов.
+    logging.getLogger('foodgram.requests').setLevel(logging.ERROR)
+
+
+class FixturesMixin:
+
+    @staticmethod
+    def create_user(username, **fields):
+        fields.setdefault('first_name', username.capitalize())
+        fields.setdefault('last_name', 'Тестов')
+        return User.objects.create_user(
+            email=f'{username}@foodgram.ru', username=username,
+            password=f'{username}-pass', **fields
+        )
+
+    @staticmethod
+    def create_tag(slug):
+        name, color = TAGS[slug]
+        return Tag.objects.create(name=name, color=color, slug=slug)
+
+    @staticmethod
+    def create_recipe(author, ingredients=None, tags=(), **fields):
+        """Рецепт с ингредиентами {ингредиент: количество} и тегами."""
+        fields.setdefault('name', 'Рецепт')
+        fields.setdefault('text', 'Описание')
+        fields.setdefault('cooking_time', 5)
+        fields.setdefault('image', 'recipes/images/test.png')
+        recipe = Recipe.objects.create(author=author, **fields)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient, amount in (ingredients or {}).items()
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag=tag) for tag in tags
+        )
+        return recipe
+
+
+class RecipeTestCase(FixturesMixin, APITestCase):
+    """Автор с рецептом, зритель, тег и ингредиент; кэш очищается перед
+    каждым тестом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author', first_name='Автор')
+        cls.viewer = cls.create_user('viewer', first_name='Зритель')
+        cls.tag = cls.create_tag('breakfast')
+        cls.salt = Ingredient.objects.create(name='соль', unit='г')
+        cls.recipe = cls.create_recipe(cls.author, {cls.salt: 5}, [cls.tag])
+
+    def setUp(self):
+        cache.clear()
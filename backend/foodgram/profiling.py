@@ -0,0 +1,169 @@
+"""Замеры запроса: SQL, сериализация, представление.
+
+Итоги отдаются в заголовке Server-Timing и строкой JSON в лог
+foodgram.requests. cProfile включается только для выборки запросов и
+для следующего запроса к маршруту, который ответил дольше порога:
+замедлить уже идущий запрос профилировщиком нельзя, а постоянный
+профилировщик удвоил бы время ответа.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('foodgram.requests')
+
+_current = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = self.view_finished = None
+        self.queries = 0
+        self.db = 0.0
+        self.timings = defaultdict(float)
+        self.depth = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        """Обёртка connection.execute_wrapper."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db += time.perf_counter() - start
+
+
+@contextmanager
+def timed(name):
+    """Время блока без запросов к БД внутри него.
+
+    Вложенные блоки с тем же именем не считаются повторно: так вложенный
+    сериализатор автора не удваивает время сериализации рецепта.
+    """
+    profile = _current.get()
+    if profile is None or profile.depth[name]:
+        yield
+        return
+    profile.depth[name] += 1
+    start, db = time.perf_counter(), profile.db
+    try:
+        yield
+    finally:
+        profile.depth[name] -= 1
+        profile.timings[name] += (
+            time.perf_counter() - start - (profile.db - db)
+        )
+
+
+class TimedSerializerMixin:
+    """Время to_representation попадает в метрику serialize."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class ProfilingMiddleware:
+    """Ставится первым в MIDDLEWARE, чтобы total покрывал весь запрос."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = settings.PROFILING
+        # Маршруты, ответившие дольше порога: следующий запрос к ним
+        # профилируется.
+        self.slow_routes = set()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        request.profile = profile
+        token = _current.set(profile)
+        try:
+            with connection.execute_wrapper(profile.execute):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            profiler = getattr(request, 'profiler', None)
+            if profiler is not None:
+                profiler.disable()
+        total = time.perf_counter() - profile.started
+        metrics = self.metrics(profile, total)
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={value * 1000:.1f}'
+            + (f';desc="{profile.queries} queries"' if name == 'db' else '')
+            for name, value in metrics.items()
+        )
+        self.log(request, response, profile, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile.view_started = time.perf_counter()
+        route = request.resolver_match.route
+        sampled = random.random() < self.options['SAMPLE_RATE']
+        if route in self.slow_routes or sampled:
+            self.slow_routes.discard(route)
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Профилировщик уже запущен в другом потоке (Python 3.12+).
+                return None
+            request.profiler = profiler
+
+    def process_template_response(self, request, response):
+        request.profile.view_finished = time.perf_counter()
+        return response
+
+    def metrics(self, profile, total):
+        metrics = {'total': total, 'db': profile.db}
+        if profile.view_started is not None:
+            metrics['view'] = (
+                profile.view_finished or time.perf_counter()
+            ) - profile.view_started
+        metrics.update(profile.timings)
+        return metrics
+
+    def log(self, request, response, profile, metrics):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': profile.queries,
+            **{
+                f'{name}_ms': round(value * 1000, 1)
+                for name, value in metrics.items()
+            },
+        }
+        slow = metrics['total'] * 1000 >= self.options['SLOW_REQUEST_MS']
+        profiler = getattr(request, 'profiler', None)
+        if profiler is not None:
+            record['profile'] = self.dump(request, profiler, metrics)
+        elif slow and request.resolver_match is not None:
+            # Профилированный запрос сам медленнее обычного: иначе
+            # медленный маршрут профилировался бы постоянно.
+            self.slow_routes.add(request.resolver_match.route)
+        logger.log(
+            logging.WARNING if slow else logging.INFO, json.dumps(record)
+        )
+
+    def dump(self, request, profiler, metrics):
+        os.makedirs(self.options['DIR'], exist_ok=True)
+        route = re.sub(r'\W+', '_', request.resolver_match.route).strip('_')
+        name = '{}-{}-{}-{}ms-{}.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S'), request.method, route or 'root',
+            round(metrics['total'] * 1000), os.getpid()
+        )
+        path = os.path.join(self.options['DIR'], name)
+        profiler.dump_stats(path)
+        return path
@@ -9,6 +9,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
+# Выставляется в asgi.py до загрузки настроек.
+ASGI = os.getenv('DJANGO_ASGI') == 'true'
+
 DEBUG = True
 
 ALLOWED_HOSTS = [
@@ -38,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,15 +74,26 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE'),
-        'NAME': os.getenv('POSTGRES_DB'),
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.getenv('POSTGRES_DB', os.path.join(BASE_DIR, 'db.sqlite3')),
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Каждый поток воркера держит своё соединение столько секунд.
+        # Под ASGI постоянные соединения выключены независимо от .env.
+        'CONN_MAX_AGE': (
+            0 if ASGI else int(os.getenv('DB_CONN_MAX_AGE', 60))
+        ),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', 'true'
+        ).lower() == 'true',
     }
 }
 
+# Соединение, простоявшее дольше, проверяется перед запросом.
+DB_HEALTH_CHECK_IDLE = float(os.getenv('DB_HEALTH_CHECK_IDLE', 1))
+
 
 AUTH_USER_MODEL = 'users.User'
 
@@ -134,3 +149,63 @@ REST_FRAMEWORK = {
 DJOSER = {
     'LOGIN_FIELD': 'email',
     }
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 3600))
+
+# Снимки рецептов не устаревают сами: ключ меняется вместе с updated_at.
+RECIPE_SNAPSHOT_TIMEOUT = int(os.getenv('RECIPE_SNAPSHOT_TIMEOUT', 86400))
+
+VIEWER_STATE_CACHE = {
+    'MAX_USERS': int(os.getenv('VIEWER_STATE_MAX_USERS', 1000)),
+    'MAX_IDS': int(os.getenv('VIEWER_STATE_MAX_IDS', 5000)),
+}
+
+# Файлы больше порога Django пишет во временный файл, а не в память.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 2 ** 20))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 40_000_000))
+IMAGE_UPLOAD_MAX_AGE = 24 * 60 * 60
+
+THUMBNAIL_SIZES = {
+    'small': '320x320',
+    'medium': '640x640',
+}
+THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+
+PROFILING = {
+    # Доля запросов, которые профилируются cProfile.
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', 0)),
+    # Дольше порога: запрос пишется в лог с WARNING, а следующий запрос
+    # к тому же маршруту профилируется.
+    'SLOW_REQUEST_MS': float(os.getenv('PROFILING_SLOW_REQUEST_MS', 1000)),
+    'DIR': os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles')),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
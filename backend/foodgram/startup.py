@@ -0,0 +1,124 @@
+"""Запуск воркеров: прогрев мастера перед fork и замер памяти.
+
+Модуль не импортирует Django на верхнем уровне: его подключает
+gunicorn.conf.py, а команда startup_benchmark запускает его отдельным
+интерпретатором:
+
+    python -m foodgram.startup --workers 4
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import sys
+import time
+
+# Модули, которые приложение импортирует лениво, при первой картинке.
+# В мастере их стоит загрузить заранее, чтобы воркеры делили их память.
+DEFERRED_MODULES = (
+    'PIL.Image',
+    'PIL.PngImagePlugin',
+    'PIL.JpegImagePlugin',
+    'sorl.thumbnail.engines.pil_engine',
+)
+
+# Кэши, которые не видны другим процессам.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def memory_usage():
+    """Память процесса в КБ: rss, pss и private — страницы, которые
+    процесс не делит с мастером."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(
+                line.split()[:2] for line in f if line.endswith('kB\n')
+            )
+    except OSError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss': rss, 'pss': None, 'private': None}
+    return {
+        'rss': int(fields['Rss:']),
+        'pss': int(fields['Pss:']),
+        'private': int(fields['Private_Clean:'])
+        + int(fields['Private_Dirty:']),
+    }
+
+
+def load_application():
+    """Импортирует WSGI-приложение и возвращает время импорта."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    start = time.perf_counter()
+    importlib.import_module('foodgram.wsgi')
+    return time.perf_counter() - start
+
+
+def shared_cache_error(workers):
+    """Ошибка конфигурации, если воркеров несколько, а кэш у каждого свой.
+
+    Версии данных, по которым сбрасываются кэшированные ответы, индекс
+    ингредиентов и отметки пользователей, хранятся в кэше Django:
+    с кэшем в памяти процесса запись в одном воркере не видна остальным.
+    """
+    from django.conf import settings
+
+    backend = settings.CACHES['default']['BACKEND']
+    if workers > 1 and backend in PROCESS_LOCAL_CACHES:
+        return (
+            f'{backend} is private to each of {workers} workers: '
+            'set CACHE_BACKEND to a shared cache (memcached, Redis) '
+            'or run a single worker'
+        )
+    return None
+
+
+def warm_up():
+    """Вызывается в мастере после загрузки приложения, перед fork.
+
+    gc.freeze() убирает загруженные объекты из поколений сборщика:
+    проходы GC в воркерах не трогают их заголовки и не копируют
+    разделяемые страницы.
+    """
+    for name in DEFERRED_MODULES:
+        importlib.import_module(name)
+    gc.freeze()
+
+
+def report(process, seconds):
+    # Одна запись в канал короче PIPE_BUF: строки воркеров не смешаются.
+    sys.stdout.write(json.dumps({
+        'process': process, 'seconds': seconds, **memory_usage()
+    }) + '\n')
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--no-preload', action='store_true')
+    options = parser.parse_args()
+    preload = not options.no_preload
+    report('master', load_application() if preload else 0.0)
+    if preload:
+        warm_up()
+    children = []
+    for number in range(options.workers):
+        pid = os.fork()
+        if pid == 0:
+            seconds = 0.0 if preload else load_application()
+            # Первый проход GC в воркере, как при обработке запросов.
+            gc.collect()
+            report(f'worker {number}', seconds)
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
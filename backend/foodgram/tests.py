@@ -0,0 +1,132 @@
+import importlib
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from foodgram.connections import check_connections, stats
+from foodgram.fixtures import (TEMP_MEDIA_ROOT, FixturesMixin,
+                               quiet_request_log, write_benchmark)
+from foodgram.startup import shared_cache_error
+
+
+def setUpModule():
+    quiet_request_log()
+
+
+def tearDownModule():
+    write_benchmark()
+
+
+class ConnectionsTest(FixturesMixin, APITransactionTestCase):
+
+    def test_health_check_before_reuse(self):
+        db = connections['default']
+        db.ensure_connection()
+        before = stats()
+        db.released_at = time.monotonic()
+        with patch.object(db, 'is_usable', return_value=False):
+            check_connections()
+            self.assertEqual(
+                stats().get('check_failed', 0), before.get('check_failed', 0)
+            )
+            db.released_at -= settings.DB_HEALTH_CHECK_IDLE + 1
+            check_connections()
+        self.assertEqual(
+            stats()['check_failed'], before.get('check_failed', 0) + 1
+        )
+
+    def test_health_endpoint(self):
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.data, {'database': 'ok'})
+        admin = self.create_user('admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/health/')
+        self.assertIn('connections', response.data)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ProfilingTest(FixturesMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = cls.create_tag('breakfast')
+
+    def setUp(self):
+        cache.clear()
+        self.profiles = tempfile.mkdtemp(dir=TEMP_MEDIA_ROOT)
+
+    def profiling(self, sample_rate=0.0, slow_request_ms=1000):
+        return override_settings(PROFILING={
+            'SAMPLE_RATE': sample_rate, 'SLOW_REQUEST_MS': slow_request_ms,
+            'DIR': self.profiles,
+        })
+
+    def records(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_server_timing(self):
+        with self.profiling(), self.assertLogs('foodgram.requests') as logs:
+            response = self.client.get('/api/tags/')
+        timing = response['Server-Timing']
+        for name in ('total', 'db', 'view', 'serialize'):
+            self.assertIn(f'{name};dur=', timing)
+        self.assertIn('desc="1 queries"', timing)
+        record, = self.records(logs)
+        self.assertEqual(record['queries'], 1)
+        self.assertEqual(record['status'], 200)
+        self.assertNotIn('profile', record)
+        self.assertEqual(os.listdir(self.profiles), [])
+
+    def test_sampled_and_slow_requests_are_profiled(self):
+        with self.profiling(sample_rate=1), self.assertLogs(
+            'foodgram.requests'
+        ) as logs:
+            self.client.get('/api/tags/')
+        self.assertTrue(os.path.exists(self.records(logs)[0]['profile']))
+        self.client = self.client_class()
+        with self.profiling(slow_request_ms=0), self.assertLogs(
+            'foodgram.requests', 'WARNING'
+        ) as logs:
+            self.client.get('/api/tags/')
+            self.client.get('/api/tags/')
+            self.client.get('/api/tags/')
+        self.assertEqual(
+            ['profile' in record for record in self.records(logs)],
+            [False, True, False]
+        )
+        self.assertEqual(len(os.listdir(self.profiles)), 2)
+
+
+class AsgiSettingsTest(SimpleTestCase):
+
+    def test_asgi_disables_persistent_connections(self):
+        from foodgram import settings as module
+
+        env = {'DB_CONN_MAX_AGE': '60', 'DJANGO_ASGI': 'true'}
+        try:
+            with patch.dict(os.environ, env):
+                importlib.reload(module)
+                database = module.DATABASES['default']
+                self.assertEqual(database['CONN_MAX_AGE'], 0)
+        finally:
+            importlib.reload(module)
+
+
+class SharedCacheTest(SimpleTestCase):
+
+    def test_process_cache_with_several_workers(self):
+        self.assertIsNone(shared_cache_error(1))
+        self.assertIn('LocMemCache', shared_cache_error(2))
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': 'memcached:11211',
+        }}):
+            self.assertIsNone(shared_cache_error(2))
@@ -0,0 +1,68 @@
+"""Настройки gunicorn для продакшена, gunicorn читает файл из текущего
+каталога.
+
+Приложение загружается в мастере до fork (preload_app): воркеры делят
+его память по copy-on-write и стартуют без повторного импорта Django.
+Код не перечитывается по HUP, после деплоя контейнер перезапускается.
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+
+def cpu_count():
+    """Ядра, доступные процессу: в контейнере их может быть меньше."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+preload_app = True
+# Запросы в основном ждут БД: по два потока на воркер. Соединений с БД
+# не больше workers * threads (см. DB_CONN_MAX_AGE).
+workers = int(os.getenv('GUNICORN_WORKERS', cpu_count() + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 2))
+# Воркер перезапускается после max_requests запросов, чтобы не копить
+# память; разброс не даёт всем воркерам перезапуститься одновременно.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Heartbeat воркеров в памяти, а не на overlay-диске контейнера.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+accesslog = '-'
+
+
+def when_ready(server):
+    """Мастер: приложение загружено, воркеры ещё не созданы."""
+    from django.db import connections
+
+    from foodgram.startup import shared_cache_error, warm_up
+
+    error = shared_cache_error(server.cfg.workers)
+    if error:
+        server.log.error(error)
+        sys.exit(1)
+    # Соединения, открытые при загрузке, не должны достаться воркерам.
+    connections.close_all()
+    warm_up()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    from foodgram.startup import memory_usage
+
+    usage = memory_usage()
+    worker.log.info(
+        'Worker %s booted in %.3f s: rss %s kB, private %s kB',
+        worker.pid, time.perf_counter() - worker.forked_at,
+        usage['rss'], usage['private']
+    )
@@ -1,7 +1,9 @@
 from django.contrib import admin
 
+from api.snapshots import touch_recipes
+
 from .models import (Favorite, Follow, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag, TagRecipe)
+                     ShoppingCart, ShoppingListItem, Tag, TagRecipe)
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -20,11 +22,10 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'tags', 'name',)
     empty_value_display = '-пусто-'
 
-    @admin.display(description='added to favorite')
+    @admin.display(description='added to favorite',
+                   ordering='favorites_count')
     def favorite_score(self, obj):
-        recipe = obj
-        score = Favorite.objects.filter(recipe=recipe).count()
-        return score
+        return obj.favorites_count
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -39,11 +40,42 @@ class TagAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class IngredientRecipeAdmin(admin.ModelAdmin):
+class RecipeRowAdmin(admin.ModelAdmin):
+    """Строки рецепта меняются без сохранения рецепта: снимки рецептов
+    обновляются по updated_at."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Строку могли перенести в другой рецепт.
+        recipe_ids = {obj.recipe_id, form.initial.get('recipe')}
+        touch_recipes(Recipe.objects.filter(pk__in=recipe_ids - {None}))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        touch_recipes(Recipe.objects.filter(pk=obj.recipe_id))
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        touch_recipes(Recipe.objects.filter(pk__in=recipe_ids))
+
+
+class IngredientRecipeAdmin(RecipeRowAdmin):
     list_display = ('recipe', 'ingredient', 'amount', )
     empty_value_display = '-пусто-'
 
 
+class TagRecipeAdmin(RecipeRowAdmin):
+    list_display = ('recipe', 'tag', )
+    empty_value_display = '-пусто-'
+
+
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total', )
+    list_select_related = ('user', 'ingredient', )
+    empty_value_display = '-пусто-'
+
+
 class FollowRecipeAdmin(admin.ModelAdmin):
     list_display = ('user', 'author',)
     empty_value_display = '-пусто-'
@@ -53,7 +85,8 @@ admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Tag, TagAdmin)
-admin.site.register(TagRecipe)
+admin.site.register(TagRecipe, TagRecipeAdmin)
 admin.site.register(Follow, FollowRecipeAdmin)
 admin.site.register(ShoppingCart)
+admin.site.register(ShoppingListItem, ShoppingListItemAdmin)
 admin.site.register(Favorite)
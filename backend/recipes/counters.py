@@ -0,0 +1,55 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import User
+
+from .models import Favorite, Follow, Recipe
+
+
+def change(model, pk, field, delta):
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def change_favorites(recipe_id, delta):
+    change(Recipe, recipe_id, 'favorites_count', delta)
+
+
+def change_recipes(author_id, delta):
+    change(User, author_id, 'recipes_count', delta)
+
+
+def change_followers(author_id, delta):
+    change(User, author_id, 'followers_count', delta)
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def reconcile():
+    """Пересчитывает разошедшиеся счётчики, возвращает число правок."""
+    fixed = {}
+    for model, field, related, lookup in COUNTERS:
+        drifted = list(
+            model.objects.annotate(
+                actual=count_of(related, lookup)
+            ).exclude(**{field: F('actual')}).values_list('pk', flat=True)
+        )
+        model.objects.filter(pk__in=drifted).update(
+            **{field: count_of(related, lookup)}
+        )
+        fixed[f'{model.__name__}.{field}'] = len(drifted)
+    return fixed
@@ -0,0 +1,299 @@
+import json
+import uuid
+from collections import Counter
+from functools import partial
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection, transaction
+from rest_framework import serializers
+
+from api.images import open_upload
+from api.response_cache import invalidate_recipes
+
+from . import counters, thumbnails
+from .models import Ingredient, IngredientRecipe, Recipe, Tag, TagRecipe
+
+IMAGE_PREFIX = 'recipes/'
+IMAGE_DIR = Recipe._meta.get_field('image').upload_to
+NAME_MAX_LENGTH = Recipe._meta.get_field('name').max_length
+
+
+def read_lines(lines):
+    """Нумерует строки NDJSON, пропуская пустые.
+
+    Байты декодируются в parse, чтобы ошибка кодировки попала в отчёт
+    о своей строке.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if line:
+            yield number, line
+
+
+def ingredient_key(item):
+    """id ингредиента или пара (название, единица); None, если значения
+    неверного типа."""
+    if 'id' in item:
+        key = item['id']
+        return key if is_integer(key) else None
+    key = (item.get('name'), item.get('measurement_unit', item.get('unit')))
+    return key if all(isinstance(value, str) for value in key) else None
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class RecipeImporter:
+    """Импорт рецептов из NDJSON пачками.
+
+    Пачка проверяется целиком: теги и ингредиенты ищутся одним запросом
+    на пачку, корректные рецепты пишутся bulk-вставками в одной
+    транзакции. Ошибки копятся по номерам строк, остальные рецепты
+    пачки при этом загружаются.
+    """
+
+    def __init__(self, author, chunk_size=500, make_thumbnails=True):
+        self.author = author
+        self.chunk_size = chunk_size
+        self.make_thumbnails = make_thumbnails
+        self.created = 0
+        self.errors = []
+        self.tags = {}
+        for tag_id, slug in Tag.objects.values_list('id', 'slug'):
+            self.tags[tag_id] = tag_id
+            self.tags[slug] = tag_id
+
+    def run(self, lines):
+        lines = read_lines(lines)
+        while True:
+            chunk = list(islice(lines, self.chunk_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+        if self.created:
+            invalidate_recipes()
+        return self.report()
+
+    def report(self):
+        return {
+            'created': self.created,
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+        }
+
+    def error(self, line, errors):
+        self.errors.append({'line': line, 'errors': errors})
+
+    def parse(self, chunk):
+        for line, text in chunk:
+            try:
+                if isinstance(text, bytes):
+                    text = text.decode('utf-8')
+                record = json.loads(text)
+            except ValueError as error:
+                self.error(line, {'non_field_errors': [str(error)]})
+                continue
+            if not isinstance(record, dict):
+                self.error(line, {'non_field_errors': ['Ожидается объект']})
+                continue
+            yield line, record
+
+    def import_chunk(self, chunk):
+        records = list(self.parse(chunk))
+        ingredients = self.find_ingredients(records)
+        valid = []
+        for line, record in records:
+            errors, data = self.validate(record, ingredients)
+            if errors:
+                self.error(line, errors)
+            else:
+                valid.append((line, data))
+        if not valid:
+            return
+        copies = []
+        try:
+            # Удаление загрузок регистрируется в транзакции сохранения:
+            # при ошибке оно откатывается вместе с ней.
+            with transaction.atomic():
+                copies = self.copy_uploads(valid)
+                self.save(valid)
+        except DatabaseError as error:
+            for name in copies:
+                default_storage.delete(name)
+            for line, _ in valid:
+                self.error(line, {'non_field_errors': [str(error)]})
+            return
+        self.created += len(valid)
+
+    def copy_uploads(self, valid):
+        """Копирует загрузки в каталог картинок рецептов, как при создании
+        рецепта через API; сами загрузки удаляются после коммита.
+
+        Вызывается внутри транзакции сохранения.
+        """
+        copies = []
+        for _, data in valid:
+            upload = data.pop('upload', None)
+            if upload is None:
+                continue
+            extension = upload.rsplit('.', 1)[-1]
+            with default_storage.open(upload) as file:
+                data['image'] = default_storage.save(
+                    f'{IMAGE_DIR}{uuid.uuid4().hex}.{extension}', file
+                )
+            copies.append(data['image'])
+            transaction.on_commit(partial(default_storage.delete, upload))
+        return copies
+
+    def find_ingredients(self, records):
+        """Ингредиенты пачки: по id и по паре (название, единица)."""
+        ids, names = set(), set()
+        for _, record in records:
+            items = record.get('ingredients')
+            for item in items if isinstance(items, list) else []:
+                if not isinstance(item, dict):
+                    continue
+                key = ingredient_key(item)
+                if isinstance(key, tuple):
+                    names.add(key[0])
+                elif key is not None:
+                    ids.add(key)
+        found = {}
+        for ingredient_id, name, unit in Ingredient.objects.filter(
+            id__in=ids
+        ).values_list('id', 'name', 'unit').union(
+            Ingredient.objects.filter(
+                name__in=names
+            ).values_list('id', 'name', 'unit')
+        ):
+            found[ingredient_id] = ingredient_id
+            found[(name, unit)] = ingredient_id
+        return found
+
+    def validate(self, record, ingredients):
+        errors, data = {}, {}
+        for field in ('name', 'text', 'image'):
+            value = record.get(field)
+            if not isinstance(value, str) or not value.strip():
+                errors[field] = ['Обязательное поле.']
+            else:
+                data[field] = value.strip()
+        if len(data.get('name', '')) > NAME_MAX_LENGTH:
+            errors['name'] = [
+                f'Убедитесь, что это значение содержит не более '
+                f'{NAME_MAX_LENGTH} символов.'
+            ]
+        cooking_time = record.get('cooking_time')
+        if not is_integer(cooking_time) or cooking_time < 1:
+            errors['cooking_time'] = ['Время приготовления больше 0']
+        data['cooking_time'] = cooking_time
+        if 'image' in data:
+            self.resolve_image(data, errors)
+        data['tags'] = self.validate_tags(record.get('tags'), errors)
+        data['ingredients'] = self.validate_ingredients(
+            record.get('ingredients'), ingredients, errors
+        )
+        return errors, data
+
+    def resolve_image(self, data, errors):
+        """Путь к файлу в хранилище или id загрузки из recipes/images/.
+
+        Загрузка копируется перед сохранением в copy_uploads.
+        """
+        reference = data['image']
+        if ':' in reference:
+            try:
+                file = open_upload(reference, self.author)
+            except serializers.ValidationError as error:
+                errors['image'] = error.detail
+                return
+            file.close()
+            data['upload'] = file.upload_name
+            return
+        if not reference.startswith(IMAGE_PREFIX) or '..' in reference or (
+            not default_storage.exists(reference)
+        ):
+            errors['image'] = [f'Файл {reference} не найден']
+
+    def validate_tags(self, tags, errors):
+        if not isinstance(tags, list) or not tags:
+            errors['tags'] = ['Укажите хотя бы один тег']
+            return []
+        tag_ids, tag_errors = [], {}
+        for index, tag in enumerate(tags):
+            tag_id = self.tags.get(tag) if isinstance(tag, (int, str)) else (
+                None
+            )
+            if tag_id is None:
+                tag_errors[index] = [f'Тег {tag} не найден']
+            elif tag_id in tag_ids:
+                tag_errors[index] = ['Теги не должны повторяться']
+            tag_ids.append(tag_id)
+        if tag_errors:
+            errors['tags'] = tag_errors
+        return tag_ids
+
+    def validate_ingredients(self, items, ingredients, errors):
+        if not isinstance(items, list) or not items:
+            errors['ingredients'] = ['Укажите хотя бы один ингредиент']
+            return Counter()
+        amounts, item_errors = Counter(), []
+        for item in items:
+            item_error = {}
+            if not isinstance(item, dict):
+                item_errors.append({'non_field_errors': ['Ожидается объект']})
+                continue
+            key = ingredient_key(item)
+            ingredient_id = None if key is None else ingredients.get(key)
+            if ingredient_id is None:
+                item_error['id'] = ['Ингредиент не найден']
+            elif ingredient_id in amounts:
+                item_error['id'] = ['Ингредиенты не должны повторяться']
+            amount = item.get('amount')
+            if not is_integer(amount) or amount < 1:
+                item_error['amount'] = [
+                    'Количество ингредиентов должно быть больше 0'
+                ]
+            elif ingredient_id is not None:
+                amounts[ingredient_id] += amount
+            item_errors.append(item_error)
+        if any(item_errors):
+            errors['ingredients'] = item_errors
+        return amounts
+
+    def save(self, valid):
+        recipes = [
+            Recipe(
+                author=self.author, name=data['name'], text=data['text'],
+                cooking_time=data['cooking_time'], image=data['image']
+            )
+            for _, data in valid
+        ]
+        Recipe.objects.bulk_create(recipes)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # Без RETURNING bulk_create не проставляет id (SQLite). Запись
+            # в SQLite блокирует всю базу до коммита: рецепты пачки —
+            # последние строки таблицы.
+            ids = Recipe.objects.order_by('-id').values_list(
+                'id', flat=True
+            )[:len(recipes)]
+            for recipe, recipe_id in zip(recipes, reversed(list(ids))):
+                recipe.id = recipe_id
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for recipe, (_, data) in zip(recipes, valid)
+            for ingredient_id, amount in data['ingredients'].items()
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=recipe, tag_id=tag_id)
+            for recipe, (_, data) in zip(recipes, valid)
+            for tag_id in data['tags']
+        )
+        # bulk_create не вызывает сигналов, которые ведут счётчик.
+        counters.change_recipes(self.author.id, len(recipes))
+        if self.make_thumbnails:
+            for recipe in recipes:
+                thumbnails.schedule(recipe.id)
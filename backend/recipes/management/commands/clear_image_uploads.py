@@ -0,0 +1,15 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.images import expired_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete uploaded recipe images that were never used'
+
+    def handle(self, *args, **options):
+        deleted = 0
+        for name in expired_uploads():
+            default_storage.delete(name)
+            deleted += 1
+        self.stdout.write(f'{deleted} uploads deleted')
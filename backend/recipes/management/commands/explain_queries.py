@@ -0,0 +1,240 @@
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes import shopping_list
+from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, Tag, TagRecipe)
+from users.models import User
+
+SEED_PREFIX = 'explain-'
+# Отдельный кэш очищается перед каждым запросом: в план попадают
+# запросы холодного пути, которые и должны опираться на индексы.
+EXPLAIN_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'explain-queries',
+    }
+}
+PROBLEMS = {
+    'postgresql': (
+        (re.compile(r'Seq Scan on (\w+)'), 'full scan'),
+        (re.compile(r'\bSort\b()'), 'sort'),
+    ),
+    'sqlite': (
+        (re.compile(r'^SCAN (?:TABLE )?(\w+)(?!.* USING)'), 'full scan'),
+        (re.compile(r'USE TEMP B-TREE()'), 'sort'),
+    ),
+}
+
+
+def endpoints(recipe, author, tag):
+    anonymous = (
+        '/api/tags/',
+        '/api/ingredients/',
+        '/api/recipes/',
+        f'/api/recipes/?tags={tag.slug}',
+        f'/api/recipes/?author={author.id}',
+        f'/api/recipes/{recipe.id}/',
+    )
+    authenticated = (
+        '/api/recipes/',
+        '/api/recipes/?is_favorited=1',
+        '/api/recipes/?is_in_shopping_cart=1',
+        f'/api/recipes/{recipe.id}/',
+        '/api/users/',
+        f'/api/users/{author.id}/',
+        '/api/users/subscriptions/',
+        '/api/recipes/download_shopping_cart/',
+    )
+    return anonymous, authenticated
+
+
+class Command(BaseCommand):
+    help = ('Replay read endpoints, EXPLAIN their SQL and report full table '
+            'scans and sorts without an index')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Add this many synthetic recipes first (rolled back)'
+        )
+        parser.add_argument('--user', help='Email of the viewer')
+        parser.add_argument('--host', default='localhost',
+                            help='Host name the site is served from')
+
+    def handle(self, *args, **options):
+        self.vendor = connection.vendor
+        if self.vendor not in PROBLEMS:
+            raise CommandError(f'EXPLAIN is not supported for {self.vendor}')
+        self.verbosity = options['verbosity']
+        self.tables = set(connection.introspection.table_names())
+        with override_settings(CACHES=EXPLAIN_CACHES), transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            if self.vendor == 'postgresql':
+                # Seq Scan при выключенном seqscan значит, что подходящего
+                # индекса нет, даже если таблица пока маленькая.
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            self.replay(options)
+            transaction.set_rollback(True)
+
+    def replay(self, options):
+        viewer = self.viewer(options['user'])
+        recipe = Recipe.objects.order_by('-pub_date', '-id').first()
+        tag = Tag.objects.order_by('id').first()
+        if recipe is None or tag is None:
+            raise CommandError('No recipes or tags to replay: use --seed')
+        anonymous, authenticated = endpoints(recipe, recipe.author, tag)
+        client = APIClient(HTTP_HOST=options['host'])
+        self.flagged, self.total = Counter(), 0
+        for url in anonymous:
+            self.explain_endpoint(client, url, 'anonymous')
+        client.force_authenticate(viewer)
+        for url in authenticated:
+            self.explain_endpoint(client, url, viewer.email)
+        for (problem, table), count in sorted(self.flagged.items()):
+            name = f'{problem} of {table}' if table else problem
+            self.stdout.write(f'{name}: {count} queries')
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.total} queries explained, '
+            f'{sum(self.flagged.values())} problems'
+        ))
+
+    def viewer(self, email):
+        if email:
+            users = User.objects.filter(email=email)
+        else:
+            # Зритель с подписками нагружает больше запросов.
+            users = User.objects.annotate(
+                follows=Count('follower')
+            ).order_by('-follows', 'id')
+        viewer = users.first()
+        if viewer is None:
+            raise CommandError('No user to replay as: use --seed or --user')
+        return viewer
+
+    def explain_endpoint(self, client, url, viewer):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: {response.status_code}')
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'GET {url} as {viewer}: {len(context)} queries'
+        ))
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            self.total += 1
+            plan = self.explain(sql)
+            problems = self.problems(plan)
+            if not problems and self.verbosity < 2:
+                continue
+            self.stdout.write(f'  {sql[:200]}')
+            for line in plan:
+                self.stdout.write(f'    {line}')
+            for problem, table in problems:
+                self.flagged[problem, table] += 1
+                self.stdout.write(self.style.WARNING(
+                    f'    ! {problem}' + (f' of {table}' if table else '')
+                ))
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if self.vendor == 'postgresql':
+                cursor.execute(f'EXPLAIN {sql}')
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def problems(self, plan):
+        found = []
+        for line in plan:
+            for pattern, problem in PROBLEMS[self.vendor]:
+                match = pattern.search(line.strip())
+                if match is None:
+                    continue
+                table = match.group(1)
+                # Подзапросы и CTE сканируются целиком по определению.
+                if problem == 'full scan' and table not in self.tables:
+                    continue
+                found.append((problem, table))
+        return found
+
+    def seed(self, count):
+        authors = max(1, count // 10)
+        User.objects.bulk_create(
+            User(
+                email=f'{SEED_PREFIX}{i}@foodgram.ru',
+                username=f'{SEED_PREFIX}{i}', first_name='Автор',
+                last_name=str(i), password='!'
+            )
+            for i in range(authors + 1)
+        )
+        users = list(User.objects.filter(
+            username__startswith=SEED_PREFIX
+        ).order_by('id'))
+        viewer, authors = users[0], users[1:]
+        Tag.objects.bulk_create(
+            Tag(name=f'{SEED_PREFIX}{i}', color=f'#E{i:05d}',
+                slug=f'{SEED_PREFIX}{i}')
+            for i in range(5)
+        )
+        tags = list(Tag.objects.filter(slug__startswith=SEED_PREFIX))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'{SEED_PREFIX}{i}', unit='г')
+            for i in range(count * 2)
+        )
+        ingredients = list(Ingredient.objects.filter(
+            name__startswith=SEED_PREFIX
+        ).values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=authors[i % len(authors)], name=f'{SEED_PREFIX}{i}',
+                text='Описание', cooking_time=i % 60 + 1,
+                image='recipes/images/test.png'
+            )
+            for i in range(count)
+        )
+        recipes = list(Recipe.objects.filter(
+            name__startswith=SEED_PREFIX
+        ).values_list('id', flat=True))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe_id=recipe_id, amount=i + 1,
+                ingredient_id=ingredients[(number + i) % len(ingredients)]
+            )
+            for number, recipe_id in enumerate(recipes)
+            for i in range(5)
+        )
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe_id=recipe_id, tag=tag)
+            for number, recipe_id in enumerate(recipes)
+            for tag in tags[:number % len(tags) + 1]
+        )
+        Follow.objects.bulk_create(
+            Follow(user=viewer, author=author) for author in authors[:10]
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=viewer, recipe_id=recipe_id)
+            for recipe_id in recipes[::3]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=viewer, recipe_id=recipe_id)
+            for recipe_id in recipes[:10]
+        )
+        shopping_list.rebuild([viewer.id])
+        self.stdout.write(f'Seeded {count} recipes')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipes import thumbnails
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate recipe image thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate existing thumbnails too')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(thumbnails={})
+        done = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            thumbnails.generate(recipe_id)
+            done += 1
+        self.stdout.write(f'{done} recipes processed')
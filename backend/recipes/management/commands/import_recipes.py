@@ -0,0 +1,47 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.importer import RecipeImporter
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from NDJSON files ("-" reads stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--author', required=True,
+                            help='Email of the author of imported recipes')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument(
+            '--skip-thumbnails', action='store_true',
+            help='Do not generate thumbnails, run generate_thumbnails later'
+        )
+
+    def handle(self, *args, **options):
+        author = User.objects.filter(email=options['author']).first()
+        if author is None:
+            raise CommandError(f'User {options["author"]} not found')
+        for path in options['paths']:
+            importer = RecipeImporter(
+                author, options['chunk_size'],
+                make_thumbnails=not options['skip_thumbnails']
+            )
+            # Строки читаются байтами: ошибка кодировки попадёт в отчёт
+            # о своей строке.
+            if path == '-':
+                report = importer.run(sys.stdin.buffer)
+            else:
+                with open(path, 'rb') as f:
+                    report = importer.run(f)
+            for error in report['errors']:
+                self.stderr.write('{}:{}: {}'.format(
+                    path, error['line'],
+                    json.dumps(error['errors'], ensure_ascii=False)
+                ))
+            self.stdout.write(self.style.SUCCESS(
+                f'{path}: {report["created"]} recipes imported, '
+                f'{len(report["errors"])} errors'
+            ))
@@ -1,16 +1,252 @@
 import csv
+import json
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers.python import Deserializer
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
 
-from recipes.models import Ingredient
+from api.conditional import invalidate_tags
+from api.response_cache import invalidate_recipes
+from api.search import invalidate_ingredient_index
+from api.viewer_state import invalidate_viewer_state
+from recipes import counters, shopping_list
+from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, Tag, TagRecipe)
+from users.models import User
+
+DEFAULT_PATH = (
+    Path(__file__).resolve().parents[2] / 'data' / 'ingredients.csv'
+)
+INGREDIENT = 'recipes.ingredient'
+# bulk_create не вызывает сигналов: состояния этих пользователей
+# сбрасываются после загрузки.
+VIEWER_MODELS = (Favorite, ShoppingCart, Follow)
+
+
+def read_csv(f):
+    for row in csv.reader(f):
+        if row:
+            name, unit = row
+            yield {'name': name, 'unit': unit}
+
+
+def read_ndjson(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_json(f):
+    data = json.load(f)
+    yield from data if isinstance(data, list) else [data]
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+    '.ndjson': read_ndjson,
+    '.jsonl': read_ndjson,
+}
+
+
+def as_fixture(record):
+    """Приводит запись к формату фикстуры Django.
+
+    Ингредиенты можно передавать без обёртки: {"name", "unit"} или
+    {"name", "measurement_unit"}, как их отдаёт API.
+    """
+    if 'model' in record:
+        return record
+    unit = record.get('unit', record.get('measurement_unit'))
+    return {
+        'model': INGREDIENT,
+        'fields': {'name': record['name'].strip(), 'unit': unit.strip()},
+    }
+
+
+@contextmanager
+def fixture_dates(model):
+    """Даты auto_now и auto_now_add берутся из фикстуры, как в loaddata.
+
+    bulk_create вызывает pre_save полей и заменил бы их временем загрузки.
+    """
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield fields
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def batches(records, size):
+    """Разбивает поток на пачки подряд идущих записей одной модели.
+
+    Порядок моделей в файле сохраняется, поэтому связанные объекты
+    пишутся после тех, на которые ссылаются.
+    """
+    batch = []
+    for record in records:
+        if batch and (
+            len(batch) == size or batch[0]['model'] != record['model']
+        ):
+            yield batch
+            batch = []
+        batch.append(record)
+    if batch:
+        yield batch
 
 
 class Command(BaseCommand):
-    help = 'Load ingredients data to DB'
+    help = 'Load ingredients or fixtures (CSV, JSON, NDJSON) to DB'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*', default=[str(DEFAULT_PATH)],
+            help='Files to load, the ingredient catalog by default',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--encoding', default='utf-8')
 
     def handle(self, *args, **options):
-        with open('recipes/data/ingredients.csv', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                name, unit = row
-                Ingredient.objects.get_or_create(name=name, unit=unit)
+        self.seen_ingredients = set()
+        self.models = set()
+        self.viewers = set()
+        for path in options['paths']:
+            self.load(Path(path), options['batch_size'], options['encoding'])
+        if Ingredient in self.models:
+            invalidate_ingredient_index()
+        if Tag in self.models:
+            invalidate_tags()
+        if self.models & {Recipe, IngredientRecipe, TagRecipe}:
+            invalidate_recipes()
+        if self.models & {IngredientRecipe, ShoppingCart}:
+            shopping_list.rebuild()
+        if self.models & {Recipe, Favorite, Follow, User}:
+            counters.reconcile()
+        for user_id in self.viewers:
+            invalidate_viewer_state(user_id)
+
+    def load(self, path, batch_size, encoding):
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError(f'Unsupported file type: {path}')
+        loaded = 0
+        with open(path, encoding=encoding) as f, transaction.atomic():
+            with connection.constraint_checks_disabled():
+                records = map(as_fixture, reader(f))
+                for batch in batches(records, batch_size):
+                    loaded += self.save(batch)
+                    self.stdout.write(
+                        f'{path.name}: {loaded} records processed'
+                    )
+            connection.check_constraints()
+            self.reset_sequences()
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name}: loaded {loaded} records'
+        ))
+
+    def save(self, batch):
+        if batch[0]['model'] == INGREDIENT:
+            batch = list(self.new_ingredients(batch))
+        objects = list(Deserializer(batch, ignorenonexistent=True))
+        if not objects:
+            return 0
+        model = type(objects[0].object)
+        self.models.add(model)
+        if model is Ingredient:
+            self.check_ingredients(objects)
+        if model in VIEWER_MODELS:
+            self.viewers.update(item.object.user_id for item in objects)
+        with fixture_dates(model) as fields:
+            now = timezone.now()
+            for item in objects:
+                for field in fields:
+                    # Без даты в фикстуре — время загрузки.
+                    if getattr(item.object, field.attname) is None and (
+                        not field.null
+                    ):
+                        setattr(item.object, field.attname, now)
+            model.objects.bulk_create(
+                (item.object for item in objects), ignore_conflicts=True
+            )
+        self.save_m2m(model, objects)
+        return len(objects)
+
+    def new_ingredients(self, batch):
+        for record in batch:
+            key = (record['fields']['name'], record['fields']['unit'])
+            if key not in self.seen_ingredients:
+                self.seen_ingredients.add(key)
+                yield record
+
+    def check_ingredients(self, objects):
+        """pk и пара (название, единица) ингредиента должны совпадать
+        с уже загруженными.
+
+        Иначе ignore_conflicts молча пропустит ингредиент, и ингредиенты
+        рецептов сошлются на чужую строку.
+        """
+        by_pk = {
+            item.object.pk: (item.object.name, item.object.unit)
+            for item in objects if item.object.pk is not None
+        }
+        if not by_pk:
+            return
+        by_key = {key: pk for pk, key in by_pk.items()}
+        existing = Ingredient.objects.filter(
+            Q(pk__in=by_pk) | Q(name__in={name for name, _ in by_key})
+        ).values_list('pk', 'name', 'unit')
+        for pk, name, unit in existing:
+            key = (name, unit)
+            if pk in by_pk and by_pk[pk] != key:
+                raise CommandError(
+                    f'Ingredient {pk} is "{name}, {unit}" in the database '
+                    f'and "{by_pk[pk][0]}, {by_pk[pk][1]}" in the fixture'
+                )
+            if by_key.get(key, pk) != pk:
+                raise CommandError(
+                    f'Ingredient "{name}, {unit}" is {pk} in the database '
+                    f'and {by_key[key]} in the fixture'
+                )
+
+    def save_m2m(self, model, objects):
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            if not through._meta.auto_created:
+                continue
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            rows = (
+                through(**{
+                    f'{source}_id': item.object.pk, f'{target}_id': pk
+                })
+                for item in objects
+                for pk in item.m2m_data.get(field.name, ())
+            )
+            while True:
+                chunk = list(islice(rows, 1000))
+                if not chunk:
+                    break
+                through.objects.bulk_create(chunk, ignore_conflicts=True)
+
+    def reset_sequences(self):
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), list(self.models)
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
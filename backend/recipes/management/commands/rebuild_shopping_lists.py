@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    help = 'Verify or rebuild aggregated shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report users whose totals differ from their carts',
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Limit to the given user id (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        broken = shopping_list.verify(user_ids)
+        if options['verify']:
+            if broken:
+                raise CommandError(
+                    'Shopping lists differ for users: {}'.format(
+                        ', '.join(map(str, broken))
+                    )
+                )
+            self.stdout.write(self.style.SUCCESS('Shopping lists are valid'))
+            return
+        shopping_list.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            'Shopping lists rebuilt, {} had drifted'.format(len(broken))
+        ))
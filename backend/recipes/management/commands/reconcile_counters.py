@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = 'Recalculate favorites, recipes and followers counters'
+
+    def handle(self, *args, **options):
+        for counter, fixed in counters.reconcile().items():
+            self.stdout.write(f'{counter}: {fixed} fixed')
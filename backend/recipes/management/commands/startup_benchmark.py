@@ -0,0 +1,83 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def parse_importtime(stderr):
+    """Собственное время импорта (мкс) по пакетам верхнего уровня."""
+    packages = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_time)
+    return packages
+
+
+class Command(BaseCommand):
+    help = ('Measure application import time and per-worker memory with '
+            'and without preloading, each in a fresh interpreter')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--top', type=int, default=10,
+                            help='Packages with the slowest imports to show')
+
+    def handle(self, *args, **options):
+        seconds = [
+            self.run()[0]['seconds'] for _ in range(options['runs'])
+        ]
+        self.stdout.write(
+            f'Application import: median {statistics.median(seconds):.3f} s,'
+            f' min {min(seconds):.3f} s ({len(seconds)} runs)'
+        )
+        packages = parse_importtime(self.run(
+            python_options=('-X', 'importtime'), stderr=True
+        ))
+        self.stdout.write('Slowest imports by package:')
+        for name, micros in packages.most_common(options['top']):
+            self.stdout.write(f'  {name:<24} {micros / 1000:8.1f} ms')
+        for arguments in ((), ('--no-preload',)):
+            title = 'without preload' if arguments else 'with preload'
+            self.stdout.write(f'Workers {title}:')
+            processes = self.run(
+                '--workers', str(options['workers']), *arguments
+            )
+            for process in sorted(processes, key=lambda p: p['process']):
+                self.stdout.write(
+                    f"  {process['process']:<10} "
+                    f"boot {process['seconds']:.3f} s, "
+                    f"rss {self.mb(process['rss'])}, "
+                    f"pss {self.mb(process['pss'])}, "
+                    f"private {self.mb(process['private'])}"
+                )
+
+    def run(self, *arguments, python_options=(), stderr=False):
+        """Запускает foodgram.startup отдельным интерпретатором."""
+        command = [
+            sys.executable, *python_options, '-m', 'foodgram.startup',
+            *arguments,
+        ]
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'foodgram.settings'}
+        result = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=env, capture_output=True,
+            text=True
+        )
+        if result.returncode:
+            raise CommandError(result.stderr)
+        if stderr:
+            return result.stderr
+        return [json.loads(line) for line in result.stdout.splitlines()]
+
+    @staticmethod
+    def mb(kilobytes):
+        if kilobytes is None:
+            return '-'
+        return f'{kilobytes / 1024:.1f} MB'
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from recipes.models import Recipe, Tag
+
+
+class Command(BaseCommand):
+    help = 'Fill the response cache with anonymous catalog and recipe pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost',
+                            help='Host name the site is served from')
+        parser.add_argument('--secure', action='store_true',
+                            help='Build https links')
+        parser.add_argument('--pages', type=int, default=3)
+        parser.add_argument(
+            '--limit', type=int,
+            default=settings.REST_FRAMEWORK['PAGE_SIZE']
+        )
+
+    def handle(self, *args, **options):
+        self.client = Client(
+            HTTP_HOST=options['host'], secure=options['secure']
+        )
+        self.cached = 0
+        self.get('/api/tags/')
+        self.get('/api/ingredients/')
+        slugs = list(Tag.objects.values_list('slug', flat=True))
+        for tags in ({}, {'tags': slugs}):
+            for page in range(1, options['pages'] + 1):
+                params = {'page': page, 'limit': options['limit'], **tags}
+                if not self.get('/api/recipes/', params, last_page=True):
+                    break
+        recipe_ids = Recipe.objects.values_list('id', flat=True)[
+            :options['pages'] * options['limit']
+        ]
+        for pk in recipe_ids:
+            self.get(f'/api/recipes/{pk}/')
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.cached} responses cached'
+        ))
+
+    def get(self, url, params=None, last_page=False):
+        response = self.client.get(url, params or {})
+        if last_page and response.status_code == 404:
+            return False
+        if response.status_code != 200:
+            raise CommandError(f'{url}: {response.status_code}')
+        self.cached += 1
+        return True
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values('name', 'unit').annotate(
+        keep=models.Min('id'), count=models.Count('id')
+    ).filter(count__gt=1)
+    for row in duplicates:
+        others = Ingredient.objects.filter(
+            name=row['name'], unit=row['unit']
+        ).exclude(id=row['keep'])
+        IngredientRecipe.objects.filter(ingredient__in=others).update(
+            ingredient_id=row['keep']
+        )
+        for item in ShoppingListItem.objects.filter(ingredient__in=others):
+            kept, created = ShoppingListItem.objects.get_or_create(
+                user_id=item.user_id, ingredient_id=row['keep'],
+                defaults={'total': item.total}
+            )
+            if not created:
+                kept.total += item.total
+                kept.save()
+            item.delete()
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'unit'), name='unique ingredient'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:20
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+INGREDIENT_NAME_INDEXES = (
+    # Поиск icontains/istartswith строится как UPPER(name) LIKE.
+    'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+    'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ingredient_name_prefix_idx '
+    'ON recipes_ingredient (UPPER(name) varchar_pattern_ops)',
+)
+
+
+def remove_duplicates(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    TagRecipe = apps.get_model('recipes', 'TagRecipe')
+    Follow = apps.get_model('recipes', 'Follow')
+    User = apps.get_model('users', 'User')
+    duplicates = IngredientRecipe.objects.values(
+        'recipe', 'ingredient'
+    ).annotate(
+        keep=models.Min('id'), total=models.Sum('amount'),
+        count=models.Count('id')
+    ).filter(count__gt=1)
+    for row in duplicates:
+        IngredientRecipe.objects.filter(pk=row['keep']).update(
+            amount=row['total']
+        )
+        IngredientRecipe.objects.filter(
+            recipe=row['recipe'], ingredient=row['ingredient']
+        ).exclude(pk=row['keep']).delete()
+    for model, fields in ((TagRecipe, ('tag', 'recipe')),
+                          (Follow, ('user', 'author'))):
+        duplicates = model.objects.values(*fields).annotate(
+            keep=models.Min('id'), count=models.Count('id')
+        ).filter(count__gt=1)
+        for row in duplicates:
+            model.objects.filter(
+                **{field: row[field] for field in fields}
+            ).exclude(pk=row['keep']).delete()
+    User.objects.update(followers_count=Coalesce(models.Subquery(
+        Follow.objects.filter(author=models.OuterRef('pk')).order_by(
+        ).values('author').annotate(count=models.Count('pk')).values('count')
+    ), 0))
+
+
+def add_ingredient_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for sql in INGREDIENT_NAME_INDEXES:
+        schema_editor.execute(sql)
+
+
+def remove_ingredient_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_thumbnails'),
+        ('users', '0004_user_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', 'id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique follow'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='ingredient in recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagrecipe',
+            constraint=models.UniqueConstraint(fields=('tag', 'recipe'), name='tag in recipe'),
+        ),
+        migrations.RunPython(
+            add_ingredient_name_indexes, remove_ingredient_name_indexes
+        ),
+    ]
@@ -24,6 +24,12 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'unit'],
+                name='unique ingredient'
+            )
+        ]
 
     def __str__(self):
         return '{}, {}'.format(self.name, self.unit)
@@ -73,6 +79,12 @@ class Recipe(models.Model):
         upload_to="recipes/images/",
         verbose_name='Картинка'
     )
+    thumbnails = models.JSONField(
+        verbose_name='Уменьшенные копии',
+        default=dict,
+        blank=True,
+        editable=False
+    )
     author = models.ForeignKey(User,
                                on_delete=models.CASCADE,
                                related_name='recipes')
@@ -82,6 +94,16 @@ class Recipe(models.Model):
         null=True,
         blank=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
 
     REQUIRED_FIELDS = [
         'name', 'text', 'cooking_time',
@@ -92,6 +114,14 @@ class Recipe(models.Model):
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', 'id'], name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date'], name='recipe_author_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -113,6 +143,12 @@ class IngredientRecipe(models.Model):
     class Meta:
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецепте'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='ingredient in recipe'
+            )
+        ]
 
     def __str__(self):
         return '{}, {}'.format(self.ingredient, self.amount)
@@ -122,6 +158,14 @@ class TagRecipe(models.Model):
     tag = models.ForeignKey(Tag, on_delete=CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['tag', 'recipe'],
+                name='tag in recipe'
+            )
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User,
@@ -131,6 +175,14 @@ class Follow(models.Model):
                                on_delete=models.CASCADE,
                                related_name="following")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique follow'
+            )
+        ]
+
     def __str__(self):
         return '{} - {}'.format(self.user, self.author)
 
@@ -166,3 +218,24 @@ class ShoppingCart(models.Model):
                 name='recipe in cart'
             )
         ]
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="shopping_list")
+    ingredient = models.ForeignKey(Ingredient, on_delete=CASCADE)
+    total = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='ingredient in shopping list'
+            )
+        ]
+
+    def __str__(self):
+        return '{}, {}'.format(self.ingredient, self.total)
@@ -0,0 +1,168 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, Sum
+
+from users.models import User
+
+from .models import IngredientRecipe, Recipe, ShoppingCart, ShoppingListItem
+
+
+def recipe_amounts(recipe_id):
+    """Количество каждого ингредиента в рецепте."""
+    return Counter(dict(
+        IngredientRecipe.objects.filter(recipe_id=recipe_id).values(
+            'ingredient'
+        ).annotate(total=Sum('amount')).values_list('ingredient', 'total')
+    ))
+
+
+def lock_recipe(recipe_id):
+    """Блокирует рецепт до конца транзакции.
+
+    Вызывается до чтения ингредиентов рецепта: правка рецепта и изменения
+    корзин с ним считают дельты по актуальным количествам, а не по
+    прочитанным до чужого коммита.
+    """
+    list(Recipe.objects.select_for_update().filter(
+        pk=recipe_id
+    ).values_list('pk'))
+
+
+def cart_users(recipe_id):
+    return list(
+        ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True
+        )
+    )
+
+
+@transaction.atomic(savepoint=False)
+def apply_delta(user_ids, delta):
+    """Прибавляет delta {ingredient_id: количество} к спискам покупок.
+
+    Строки пользователей блокируются, чтобы параллельные изменения
+    корзины одного пользователя не теряли друг друга.
+    """
+    delta = {key: value for key, value in delta.items() if value}
+    if not user_ids or not delta:
+        return
+    list(User.objects.select_for_update().filter(
+        pk__in=user_ids
+    ).order_by('pk').values_list('pk'))
+    items = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=delta
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, amount in delta.items():
+            item = items.get((user_id, ingredient_id))
+            if item is None:
+                if amount > 0:
+                    to_create.append(ShoppingListItem(
+                        user_id=user_id, ingredient_id=ingredient_id,
+                        total=amount
+                    ))
+                continue
+            item.total += amount
+            if item.total > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ['total'])
+    ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+@transaction.atomic(savepoint=False)
+def add_recipe(user_id, recipe_id):
+    lock_recipe(recipe_id)
+    apply_delta([user_id], recipe_amounts(recipe_id))
+
+
+@transaction.atomic(savepoint=False)
+def remove_recipe(user_id, recipe_id):
+    lock_recipe(recipe_id)
+    apply_delta([user_id], {
+        key: -value for key, value in recipe_amounts(recipe_id).items()
+    })
+
+
+@transaction.atomic(savepoint=False)
+def change_ingredient(recipe_id, ingredient_id, amount):
+    """Прибавляет amount ингредиента к спискам покупателей рецепта:
+    строку ингредиента рецепта добавили, изменили или удалили."""
+    lock_recipe(recipe_id)
+    apply_delta(cart_users(recipe_id), {ingredient_id: amount})
+
+
+def change_recipe(recipe_id, old_amounts, new_amounts):
+    """Переносит правку ингредиентов рецепта в списки его покупателей.
+
+    Старые количества должны быть прочитаны после lock_recipe в той же
+    транзакции. Для строк, которые меняются через save() и delete(),
+    списки обновляют сигналы (api.signals), сюда передаются только
+    правки bulk_create и bulk_update.
+    """
+    delta = Counter(new_amounts)
+    delta.subtract(old_amounts)
+    apply_delta(cart_users(recipe_id), delta)
+
+
+def computed_totals(user_ids=None):
+    """Итоги, посчитанные заново по корзинам."""
+    carts = ShoppingCart.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    rows = carts.values(
+        'user', ingredient=F('recipe__ingredient_recipe__ingredient')
+    ).annotate(
+        total=Sum('recipe__ingredient_recipe__amount')
+    ).values_list('user', 'ingredient', 'total')
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in rows
+        if ingredient_id is not None
+    }
+
+
+def stored_totals(user_ids=None):
+    queryset = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        queryset = queryset.filter(user_id__in=user_ids)
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in queryset.values_list(
+            'user_id', 'ingredient_id', 'total'
+        )
+    }
+
+
+def verify(user_ids=None):
+    """Возвращает id пользователей, у которых итоги разошлись."""
+    computed = computed_totals(user_ids)
+    stored = stored_totals(user_ids)
+    return sorted({
+        user_id for user_id, ingredient_id in computed.keys() | stored.keys()
+        if computed.get((user_id, ingredient_id))
+        != stored.get((user_id, ingredient_id))
+    })
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, total=total
+        )
+        for (user_id, ingredient_id), total in computed_totals(
+            user_ids
+        ).items()
+    )
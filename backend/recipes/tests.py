@@ -0,0 +1,509 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import Mock, call, patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from api.viewer_state import viewer_states
+from foodgram.fixtures import (IMAGE, TEMP_MEDIA_ROOT, TIMINGS, FixturesMixin,
+                               RecipeTestCase, quiet_request_log,
+                               write_benchmark)
+from recipes import counters, shopping_list, thumbnails
+from recipes.models import (Favorite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe)
+from users.models import User
+
+
+def setUpModule():
+    quiet_request_log()
+
+
+def tearDownModule():
+    write_benchmark()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTest(RecipeTestCase):
+
+    def test_generated_after_commit(self):
+        self.client.force_authenticate(self.author)
+        with patch('recipes.thumbnails.executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/recipes/', {
+                    'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 5,
+                    'image': IMAGE, 'tags': [self.tag.id],
+                    'ingredients': [{'id': self.salt.id, 'amount': 1}],
+                }, format='json')
+        recipe_id = response.data['id']
+        executor.submit.assert_called_once_with(thumbnails.run, recipe_id)
+        url = f'/api/recipes/{recipe_id}/'
+        self.assertEqual(self.client.get(url).data['thumbnails'], {})
+        thumbnails.generate(recipe_id)
+        data = self.client.get(url).data['thumbnails']
+        self.assertEqual(set(data), set(settings.THUMBNAIL_SIZES))
+        for size, formats in data.items():
+            self.assertEqual(
+                set(formats),
+                {image_format.lower() for image_format in thumbnails.formats()}
+            )
+            self.assertTrue(formats['jpeg'].startswith('http'))
+            name = Recipe.objects.get(pk=recipe_id).thumbnails[size]['jpeg']
+            self.assertTrue(os.path.exists(
+                os.path.join(TEMP_MEDIA_ROOT, name)
+            ))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeImportTest(FixturesMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author', first_name='Автор')
+        cls.tag = cls.create_tag('breakfast')
+        cls.salt = Ingredient.objects.create(name='соль', unit='г')
+        Ingredient.objects.create(name='сахар', unit='г')
+
+    def setUp(self):
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'recipes/images'),
+                    exist_ok=True)
+        with open(os.path.join(TEMP_MEDIA_ROOT, 'recipes/images/import.png'),
+                  'wb') as f:
+            f.write(base64.b64decode(IMAGE.split(',')[1]))
+
+    def record(self, number, **fields):
+        return json.dumps({
+            'name': f'Рецепт {number}', 'text': 'Описание',
+            'cooking_time': 10, 'image': 'recipes/images/import.png',
+            'tags': ['breakfast'],
+            'ingredients': [
+                {'id': self.salt.id, 'amount': 5},
+                {'name': 'сахар', 'measurement_unit': 'г', 'amount': 10},
+            ],
+            **fields,
+        }, ensure_ascii=False)
+
+    def test_command(self):
+        lines = [self.record(number) for number in range(2000)]
+        lines[10] = self.record(10, tags=['unknown'])
+        lines[20] = self.record(20, ingredients=[{'id': 0, 'amount': 1}])
+        lines[30] = 'not json'
+        path = os.path.join(TEMP_MEDIA_ROOT, 'recipes.ndjson')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        stderr = StringIO()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                'import_recipes', path, '--author', self.author.email,
+                '--skip-thumbnails', stdout=StringIO(), stderr=stderr
+            )
+        TIMINGS['import 2000 recipes'].append(time.perf_counter() - start)
+        self.assertEqual(
+            [line.split(': ')[0].rsplit(':', 1)[1]
+             for line in stderr.getvalue().splitlines()],
+            ['11', '21', '31']
+        )
+        self.assertEqual(Recipe.objects.count(), 1997)
+        self.assertEqual(IngredientRecipe.objects.count(), 1997 * 2)
+        self.assertEqual(TagRecipe.objects.count(), 1997)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1997)
+        # Запросы идут на пачку, а не на рецепт.
+        self.assertLess(len(queries), 100)
+
+    def test_endpoint(self):
+        url = '/api/recipes/import/'
+        body = '\n'.join([self.record(1), self.record(2, cooking_time=0)])
+        response = self.client.post(
+            url, body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.client.force_authenticate(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, body, content_type='application/x-ndjson'
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+        self.assertIn('cooking_time', response.data['errors'][0]['errors'])
+        self.assertEqual(
+            Recipe.objects.get().ingredient_recipe.count(), 2
+        )
+        self.assertLessEqual(len(queries), 12)
+
+    def test_invalid_values(self):
+        lines = [
+            self.record(1, ingredients=[{'id': [1], 'amount': 1}]),
+            self.record(2, ingredients=[
+                {'name': ['соль'], 'measurement_unit': 'г', 'amount': 1}
+            ]),
+            self.record(3, ingredients=[{'id': self.salt.id, 'amount': '1'}]),
+            self.record(4, cooking_time=True),
+        ]
+        body = b'\n'.join(
+            [line.encode() for line in lines]
+            + [b'{"name": "\xff"}', self.record(6).encode()]
+        )
+        self.client.force_authenticate(self.author)
+        response = self.client.post(
+            '/api/recipes/import/', body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(
+            [error['line'] for error in response.data['errors']],
+            [1, 2, 3, 4, 5]
+        )
+
+    @patch('recipes.thumbnails.executor')
+    def test_upload_is_copied(self, executor):
+        self.client.force_authenticate(self.author)
+        content = base64.b64decode(IMAGE.split(',')[1])
+        upload_id = self.client.post(
+            '/api/recipes/images/',
+            {'image': SimpleUploadedFile('image.png', content)},
+            format='multipart'
+        ).data['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/recipes/import/', self.record(1, image=upload_id),
+                content_type='application/x-ndjson'
+            )
+        self.assertEqual(response.data['created'], 1, response.data)
+        image = Recipe.objects.get().image.name
+        self.assertTrue(image.startswith('recipes/images/'), image)
+        self.assertTrue(os.path.exists(os.path.join(TEMP_MEDIA_ROOT, image)))
+        self.assertEqual(
+            os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'recipes/uploads')), []
+        )
+        upload_id = self.client.post(
+            '/api/recipes/images/',
+            {'image': SimpleUploadedFile('image.png', content)},
+            format='multipart'
+        ).data['id']
+        with self.settings(IMAGE_UPLOAD_MAX_AGE=-1):
+            response = self.client.post(
+                '/api/recipes/import/', self.record(2, image=upload_id),
+                content_type='application/x-ndjson'
+            )
+        self.assertIn('image', response.data['errors'][0]['errors'])
+        shutil.rmtree(os.path.join(TEMP_MEDIA_ROOT, 'recipes/uploads'))
+
+    def test_upload_is_kept_on_error(self):
+        self.client.force_authenticate(self.author)
+        content = base64.b64decode(IMAGE.split(',')[1])
+        upload_id = self.client.post(
+            '/api/recipes/images/',
+            {'image': SimpleUploadedFile('image.png', content)},
+            format='multipart'
+        ).data['id']
+        uploads = os.path.join(TEMP_MEDIA_ROOT, 'recipes/uploads')
+        images = os.path.join(TEMP_MEDIA_ROOT, 'recipes/images')
+        self.addCleanup(shutil.rmtree, uploads)
+        before = set(os.listdir(images))
+        with self.captureOnCommitCallbacks(execute=True), patch(
+            'recipes.importer.RecipeImporter.save',
+            side_effect=DatabaseError('сбой')
+        ):
+            response = self.client.post(
+                '/api/recipes/import/', self.record(1, image=upload_id),
+                content_type='application/x-ndjson'
+            )
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(len(os.listdir(uploads)), 1)
+        self.assertEqual(set(os.listdir(images)), before)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ShoppingListTest(FixturesMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('cook', first_name='Повар')
+        cls.salt = Ingredient.objects.create(name='соль', unit='г')
+        cls.flour = Ingredient.objects.create(name='мука', unit='г')
+        cls.tag = cls.create_tag('lunch')
+        cls.recipes = [
+            cls.create_recipe(
+                cls.user, {cls.salt: salt, cls.flour: flour}, [cls.tag],
+                name='Хлеб', cooking_time=60
+            )
+            for salt, flour in ((5, 100), (3, 200))
+        ]
+        counters.reconcile()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes:
+            self.client.get(f'/api/recipes/{recipe.id}/shopping_cart/')
+
+    def totals(self):
+        response = self.client.get('/api/recipes/shopping_cart_totals/')
+        self.assertEqual(shopping_list.verify(), [])
+        return {item['name']: item['amount'] for item in response.data}
+
+    def test_cart_changes(self):
+        self.assertEqual(self.totals(), {'соль': 8, 'мука': 300})
+        self.client.delete(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(self.totals(), {'соль': 3, 'мука': 200})
+        self.client.delete(f'/api/recipes/{self.recipes[1].id}/shopping_cart/')
+        self.assertEqual(self.totals(), {})
+
+    def test_recipe_edit_and_delete(self):
+        self.client.patch(
+            f'/api/recipes/{self.recipes[0].id}/',
+            {
+                'name': 'Хлеб', 'text': 'Описание', 'cooking_time': 60,
+                'image': IMAGE, 'tags': [self.tag.id],
+                'ingredients': [{'id': self.salt.id, 'amount': 1}],
+            },
+            format='json'
+        )
+        self.assertEqual(self.totals(), {'соль': 4, 'мука': 200})
+        self.client.delete(f'/api/recipes/{self.recipes[1].id}/')
+        self.assertEqual(self.totals(), {'соль': 1})
+
+    def test_direct_changes(self):
+        ShoppingCart.objects.filter(recipe=self.recipes[0]).delete()
+        self.assertEqual(self.totals(), {'соль': 3, 'мука': 200})
+        row = IngredientRecipe.objects.get(
+            recipe=self.recipes[1], ingredient=self.flour
+        )
+        row.amount = 50
+        row.save()
+        self.assertEqual(self.totals(), {'соль': 3, 'мука': 50})
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[0])
+        self.assertEqual(self.totals(), {'соль': 8, 'мука': 150})
+        self.recipes[1].delete()
+        self.assertEqual(self.totals(), {'соль': 5, 'мука': 100})
+        self.salt.delete()
+        self.assertEqual(self.totals(), {'мука': 100})
+
+    def test_recipe_is_locked_before_reading_amounts(self):
+        recipe_id = self.recipes[0].id
+        steps = Mock()
+        steps.read.return_value = {}
+        with patch.object(shopping_list, 'lock_recipe', steps.lock), \
+                patch.object(shopping_list, 'recipe_amounts', steps.read):
+            self.client.delete(f'/api/recipes/{recipe_id}/shopping_cart/')
+            self.client.patch(f'/api/recipes/{recipe_id}/', {
+                'ingredients': [{'id': self.salt.id, 'amount': 1}],
+            }, format='json')
+        # Последняя блокировка — удаление строки муки.
+        self.assertEqual(steps.mock_calls, [
+            call.lock(recipe_id), call.read(recipe_id), call.lock(recipe_id),
+            call.lock(recipe_id),
+        ])
+
+    def test_rebuild_command(self):
+        ShoppingListItem.objects.filter(ingredient=self.salt).delete()
+        with self.assertRaises(CommandError):
+            call_command(
+                'rebuild_shopping_lists', '--verify', stdout=StringIO()
+            )
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        self.assertEqual(self.totals(), {'соль': 8, 'мука': 300})
+
+
+class LoadDataTest(FixturesMixin, APITestCase):
+
+    def load(self, *args):
+        call_command('load_data', *args, stdout=StringIO())
+
+    def test_catalog_load_is_idempotent(self):
+        self.load()
+        count = Ingredient.objects.count()
+        self.assertGreater(count, 2000)
+        self.load()
+        self.assertEqual(Ingredient.objects.count(), count)
+
+    def test_ndjson_is_deduplicated(self):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.ndjson', encoding='utf-8', delete=False
+        ) as f:
+            f.write(
+                '{"name": "соль", "measurement_unit": "г"}\n'
+                '{"name": "соль ", "unit": "г"}\n'
+                '\n'
+                '{"model": "recipes.tag", "pk": 7, "fields": '
+                '{"name": "Ужин", "color": "#8775D2", "slug": "dinner"}}\n'
+            )
+        self.addCleanup(os.remove, f.name)
+        self.load(f.name, '--batch-size', '1')
+        self.load(f.name)
+        self.assertEqual(
+            list(Ingredient.objects.values_list('name', 'unit')),
+            [('соль', 'г')]
+        )
+        self.assertEqual(Tag.objects.get(pk=7).slug, 'dinner')
+
+    def write(self, *records):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.ndjson', encoding='utf-8', delete=False
+        ) as f:
+            f.write('\n'.join(json.dumps(record) for record in records))
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_viewer_state_is_invalidated(self):
+        viewer = self.create_user('viewer')
+        recipe = self.create_recipe(self.create_user('author'))
+        self.assertEqual(viewer_states.get(viewer.id).favorites, set())
+        self.load(self.write({
+            'model': 'recipes.favorite',
+            'fields': {'user': viewer.id, 'recipe': recipe.id},
+        }))
+        self.assertEqual(viewer_states.get(viewer.id).favorites, {recipe.id})
+
+    def test_fixture_dates_are_kept(self):
+        author = self.create_user('author', first_name='Автор')
+        self.load(self.write({
+            'model': 'recipes.recipe', 'pk': 5, 'fields': {
+                'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 5,
+                'image': 'recipes/images/test.png', 'author': author.id,
+                'pub_date': '2021-12-06T10:00:00Z',
+            },
+        }))
+        recipe = Recipe.objects.get(pk=5)
+        self.assertEqual(recipe.pub_date.isoformat(),
+                         '2021-12-06T10:00:00+00:00')
+        self.assertIsNotNone(recipe.updated_at)
+        self.assertTrue(Recipe._meta.get_field('pub_date').auto_now_add)
+
+    def test_ingredient_conflicts_fail(self):
+        salt = Ingredient.objects.create(name='соль', unit='г')
+        self.load(self.write({
+            'model': 'recipes.ingredient', 'pk': salt.pk,
+            'fields': {'name': 'соль', 'unit': 'г'},
+        }))
+        for pk, name in ((salt.pk, 'сахар'), (salt.pk + 1, 'соль')):
+            with self.assertRaises(CommandError):
+                self.load(self.write({
+                    'model': 'recipes.ingredient', 'pk': pk,
+                    'fields': {'name': name, 'unit': 'г'},
+                }))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CountersTest(FixturesMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('cook', first_name='Повар')
+        cls.author = cls.create_user('author', first_name='Автор')
+        cls.tag = cls.create_tag('lunch')
+        cls.ingredient = Ingredient.objects.create(name='соль', unit='г')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.author)
+
+    def counts(self, recipe_id=None):
+        self.author.refresh_from_db()
+        favorites = None
+        if recipe_id is not None:
+            favorites = Recipe.objects.get(pk=recipe_id).favorites_count
+        return (
+            self.author.recipes_count, self.author.followers_count, favorites
+        )
+
+    def test_writes_update_counters(self):
+        response = self.client.post(
+            '/api/recipes/',
+            {
+                'name': 'Суп', 'text': 'Описание', 'cooking_time': 30,
+                'image': IMAGE, 'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 5}],
+            },
+            format='json'
+        )
+        recipe_id = response.data['id']
+        self.assertEqual(self.counts(recipe_id), (1, 0, 0))
+        self.client.force_authenticate(self.user)
+        self.client.get(f'/api/recipes/{recipe_id}/favorite/')
+        self.client.get(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.counts(recipe_id), (1, 1, 1))
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.data['results'][0]['recipes_count'], 1)
+        self.client.delete(f'/api/recipes/{recipe_id}/favorite/')
+        self.client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(self.counts(recipe_id), (1, 0, 0))
+        self.client.force_authenticate(self.author)
+        self.client.delete(f'/api/recipes/{recipe_id}/')
+        self.assertEqual(self.counts(), (0, 0, None))
+
+    def test_direct_changes(self):
+        # Правки из админки и кода минуют представления API.
+        recipe = self.create_recipe(self.author)
+        other = self.create_recipe(self.user)
+        favorite = Favorite.objects.create(user=self.user, recipe=recipe)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.counts(recipe.id), (1, 1, 1))
+        favorite.recipe = other
+        favorite.save()
+        self.assertEqual(self.counts(recipe.id), (1, 1, 0))
+        self.assertEqual(Recipe.objects.get(pk=other.pk).favorites_count, 1)
+        recipe.author = self.user
+        recipe.save()
+        self.assertEqual(self.counts(), (0, 1, None))
+        self.user.delete()
+        self.assertEqual(self.counts(), (0, 0, None))
+        self.assertEqual(counters.reconcile(), {
+            'Recipe.favorites_count': 0,
+            'User.recipes_count': 0,
+            'User.followers_count': 0,
+        })
+
+    def test_reconcile_fixes_drift(self):
+        User.objects.filter(pk=self.author.pk).update(
+            recipes_count=5, followers_count=3
+        )
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('User.recipes_count: 1 fixed', out.getvalue())
+        self.assertEqual(self.counts(), (0, 0, None))
+
+
+class ExplainQueriesTest(APITestCase):
+
+    def test_seeded_replay(self):
+        out = StringIO()
+        call_command(
+            'explain_queries', '--seed', '30', '--host', 'testserver',
+            verbosity=2, stdout=out
+        )
+        output = out.getvalue()
+        self.assertIn('GET /api/users/subscriptions/', output)
+        self.assertIn('recipe_author_idx', output)
+        self.assertRegex(output, r'\d+ queries explained')
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+class StartupBenchmarkTest(APITestCase):
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            'startup_benchmark', '--runs', '1', '--workers', '1',
+            stdout=out
+        )
+        output = out.getvalue()
+        self.assertIn('Application import: median', output)
+        self.assertIn('django', output)
+        self.assertEqual(output.count('worker 0'), 2)
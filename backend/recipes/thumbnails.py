@@ -0,0 +1,69 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+
+from api.response_cache import invalidate_recipes
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails'
+)
+
+
+def formats():
+    """Форматы из настроек, которые умеет записывать сборка Pillow."""
+    from PIL import Image
+
+    Image.init()
+    return [
+        image_format for image_format in settings.THUMBNAIL_FORMATS
+        if image_format in Image.SAVE
+    ]
+
+
+def build(image):
+    """Уменьшенные копии картинки: {размер: {формат: путь в хранилище}}."""
+    return {
+        size: {
+            image_format.lower(): get_thumbnail(
+                image, geometry, crop='center', format=image_format,
+                quality=settings.THUMBNAIL_QUALITY
+            ).name
+            for image_format in formats()
+        }
+        for size, geometry in settings.THUMBNAIL_SIZES.items()
+    }
+
+
+def generate(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return
+    thumbnails = build(recipe.image)
+    # Картинку могли заменить, пока шла обработка.
+    if Recipe.objects.filter(pk=recipe_id, image=recipe.image.name).update(
+        thumbnails=thumbnails, updated_at=timezone.now()
+    ):
+        invalidate_recipes()
+
+
+def run(recipe_id):
+    try:
+        generate(recipe_id)
+    except Exception:
+        logger.exception('Thumbnails for recipe %s failed', recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule(recipe_id):
+    """Ставит обработку в фоновый поток после коммита транзакции."""
+    transaction.on_commit(partial(executor.submit, run, recipe_id))
@@ -2,12 +2,13 @@ from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.models import Follow
+from api.viewer_state import get_viewer_state
+from foodgram.profiling import TimedSerializerMixin
 
 from .models import User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -19,16 +20,10 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request', None)
-        user = request.user
-        user_is_subscibed = False
-        author = obj
-        try:
-            user_is_subscibed = Follow.objects.filter(
-                user=user, author=author
-            ).exists()
-        except Exception:
-            return user_is_subscibed
-        return user_is_subscibed
+        state = get_viewer_state(request)
+        if state is not None:
+            return obj.id in state.following
+        return getattr(obj, 'is_subscribed', False)
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -38,7 +33,9 @@ class UserCreateSerializer(serializers.ModelSerializer):
     )
 
     def create(self, validated_data):
-        user = super().create(validated_data)
+        # Одна вставка уже с хешем пароля: сохранение существующего
+        # пользователя обновляет updated_at его рецептов.
+        user = User(**validated_data)
         user.set_password(validated_data['password'])
         user.save()
         return user
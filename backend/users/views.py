@@ -1,11 +1,13 @@
 
 from django.contrib.auth import update_session_auth_hash
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import decorators, permissions, status, viewsets
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from api.pagination import CustomPageNumberPagination
 from api.permissions import IsAuthor
+from api.querysets import get_recipes_limit, recipe_previews, with_subscription
 from api.serializers import FollowListSerializer, FollowSerializer
 from recipes.models import Follow
 
@@ -29,6 +31,12 @@ class UserViewSet(viewsets.ModelViewSet):
         elif self.action == 'set_password':
             return SetPasswordSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = with_subscription(queryset, self.request)
+        return queryset
+
     def get_permissions(self):
         if self.action == 'create':
             self.permission_classes = [permissions.AllowAny, ]
@@ -55,7 +63,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.request.user.set_password(serializer.data["new_password"])
-        self.request.user.save()
+        self.request.user.save(update_fields=["password"])
         update_session_auth_hash(self.request, self.request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -65,11 +73,19 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthor, ],
     )
     def subscriptions(self, request, *args, **kwargs):
-        authors = User.objects.filter(following__user=request.user)
-        paginator = PageNumberPagination()
-        paginator.page_size = 6
+        authors = User.objects.filter(
+            following__user=request.user
+        ).order_by('username')
+        paginator = CustomPageNumberPagination()
         authors_page = paginator.paginate_queryset(authors, request)
-        serializer = FollowListSerializer(authors_page, many=True)
+        previews = recipe_previews(
+            [author.id for author in authors_page],
+            get_recipes_limit(request)
+        )
+        serializer = FollowListSerializer(
+            authors_page, many=True,
+            context={'request': request, 'recipe_previews': previews}
+        )
         return paginator.get_paginated_response(serializer.data)
 
     @decorators.action(
@@ -88,17 +104,24 @@ class UserViewSet(viewsets.ModelViewSet):
                     data={'user': user_pk, 'author': author_id}
                 )
                 serializer_val.is_valid(raise_exception=True)
-                serializer_val.save()
-                serializer = FollowListSerializer(author)
+                with transaction.atomic():
+                    serializer_val.save()
+                serializer = FollowListSerializer(
+                    author, context={'request': request}
+                )
                 return Response(serializer.data)
             return Response(
                     data={"errors": "Подписка на себя запрещена"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
         elif request.method == 'DELETE':
-            follow = Follow.objects.filter(user=user, author=author)
-            if follow.exists():
-                follow.delete()
+            with transaction.atomic():
+                follow = Follow.objects.select_for_update().filter(
+                    user=user, author=author
+                ).first()
+                if follow is not None:
+                    follow.delete()
+            if follow is not None:
                 return Response(status=status.HTTP_204_NO_CONTENT)
             else:
                 return Response(